@@ -0,0 +1,91 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+
+class SubstringIndex(object):
+    '''
+    Case-insensitive substring search over a fixed list of strings, built once.
+    Prefix matches come first, in alphabetical order;
+    Other matches follow, in the original order.
+
+    >>> index = SubstringIndex(['CD4', 'ACD1', 'CD44', 'BRCA1', 'cdk2'])
+    >>> [m['full'] for m in index.search('cd', 10)]
+    ['CD4', 'CD44', 'cdk2', 'ACD1']
+    >>> index.search('cd4', 1)
+    [{'full': 'CD4', 'pre': '', 'match': 'CD4', 'post': ''}]
+    >>> index.search('ca1', 10)
+    [{'full': 'BRCA1', 'pre': 'BR', 'match': 'CA1', 'post': ''}]
+    >>> index.search('zzz', 10)
+    []
+    '''
+
+    def __init__(self, strings, max_gram=3):
+        self.strings = tuple(strings)
+        self.lowers = tuple(s.lower() for s in self.strings)
+        self.max_gram = max_gram
+        # For prefix matches:
+        self._sorted = sorted((lower, i) for i, lower in enumerate(self.lowers))
+        # For other matches: Postings are in original order, with no repeats.
+        grams = defaultdict(list)
+        for i, lower in enumerate(self.lowers):
+            for gram in _grams(lower, max_gram):
+                grams[gram].append(i)
+        self._grams = dict(grams)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def _prefix_matches(self, query):
+        for position in range(bisect_left(self._sorted, (query,)), len(self._sorted)):
+            lower, i = self._sorted[position]
+            if not lower.startswith(query):
+                return
+            yield i
+
+    def _other_matches(self, query):
+        # Only strings containing the least common n-gram of the query need to be checked.
+        query_grams = _grams(query, self.max_gram) if len(query) > self.max_gram else [query]
+        postings = [self._grams.get(gram, []) for gram in query_grams]
+        for i in min(postings, key=len):
+            lower = self.lowers[i]
+            if query in lower and not lower.startswith(query):
+                yield i
+
+    def search(self, substring, n):
+        query = substring.lower()
+        matches = []
+        if query:
+            for matched in (self._prefix_matches(query), self._other_matches(query)):
+                for i in matched:
+                    matches.append(i)
+                    if len(matches) == n:
+                        break
+                if len(matches) == n:
+                    break
+        else:
+            matches = list(range(min(n, len(self.strings))))
+        return [self._highlight(i, query) for i in matches]
+
+    def _highlight(self, i, query):
+        s = self.strings[i]
+        offset = self.lowers[i].find(query)
+        return {
+            'full': s,
+            'pre': s[:offset],
+            'match': s[offset:offset + len(query)],
+            'post': s[offset + len(query):]
+        }
+
+
+def _grams(s, max_gram):
+    '''
+    All distinct substrings of length `max_gram`, or less if the string is shorter.
+
+    >>> sorted(_grams('abcd', 3))
+    ['a', 'ab', 'abc', 'b', 'bc', 'bcd', 'c', 'cd', 'd']
+    '''
+    return {
+        s[start:start + length]
+        for length in range(1, max_gram + 1)
+        for start in range(len(s) - length + 1)
+    }
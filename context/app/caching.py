@@ -0,0 +1,353 @@
+import gzip
+import json
+from collections import OrderedDict
+from hashlib import sha256
+from logging import getLogger
+from os import getpid, makedirs, replace
+from pathlib import Path
+from threading import Lock, Thread, get_ident
+from time import monotonic, time
+
+from flask import current_app
+
+
+class TTLCache(object):
+    '''
+    A thread-safe, size-bounded LRU cache whose entries expire after `ttl` seconds.
+
+    >>> now = [0]
+    >>> cache = TTLCache(maxsize=2, ttl=10, timer=lambda: now[0])
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)  # Evicts 'b', the least recently used.
+    >>> cache.get('b') is None
+    True
+    >>> now[0] = 11
+    >>> cache.get('a') is None
+    True
+    >>> cache.stats()
+    {'hits': 1, 'misses': 2, 'size': 1, 'maxsize': 2, 'ttl': 10}
+    '''
+
+    def __init__(self, maxsize=128, ttl=60, timer=monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._lookup(key, count=False) is not _missing
+
+    def _lookup(self, key, count=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self._timer():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return _missing
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[1]
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        return default if value is _missing else value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._timer() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_set(self, key, compute):
+        '''
+        Returns the cached value, or calls `compute()` and caches the result.
+        The lock is not held while computing, so concurrent misses may both compute.
+
+        >>> cache = TTLCache()
+        >>> cache.get_or_set('x', lambda: 42)
+        42
+        >>> cache.get_or_set('x', lambda: 0)
+        42
+        '''
+        value = self._lookup(key)
+        if value is _missing:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+        }
+
+
+class RefreshingValue(object):
+    '''
+    Holds the result of `load()`. The first `get()` loads it synchronously;
+    After `ttl` seconds, the stale value is still returned, while it is reloaded
+    on a background thread (stale-while-revalidate).
+    If a reload fails, the stale value is kept, and reload is retried after `error_ttl`.
+
+    >>> now = [0]
+    >>> versions = iter(['v1', 'v2'])
+    >>> value = RefreshingValue(lambda: next(versions), ttl=10, timer=lambda: now[0],
+    ...                         background=False)
+    >>> value.get()
+    'v1'
+    >>> now[0] = 11
+    >>> value.get()  # Without background, the reload finishes before returning.
+    'v2'
+    >>> now[0] = 22
+    >>> value.get()  # Load fails: Keep the stale value.
+    'v2'
+    '''
+
+    def __init__(self, load, ttl=3600, error_ttl=60, timer=monotonic, background=True):
+        self._load = load
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self._timer = timer
+        self._background = background
+        self._lock = Lock()
+        self._value = _missing
+        self._expires = None
+        self._refreshing = False
+
+    @property
+    def is_loaded(self):
+        return self._value is not _missing
+
+    def get(self):
+        if self._value is _missing:
+            with self._lock:
+                if self._value is _missing:
+                    self._store(self._load())
+        elif self._expires <= self._timer():
+            self._start_refresh()
+        return self._value
+
+    def _store(self, value):
+        self._value = value
+        self._expires = self._timer() + self.ttl
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        if self._background:
+            Thread(target=self._refresh, daemon=True).start()
+        else:
+            self._refresh()
+
+    def _refresh(self):
+        try:
+            self._store(self._load())
+        except Exception:
+            _logger.exception('Refresh failed; Keeping the stale value.')
+            self._expires = self._timer() + self.error_ttl
+        finally:
+            self._refreshing = False
+
+
+class DiskCache(object):
+    '''
+    JSON values, gzipped on disk, so that they survive restarts and can be shared by workers.
+    Entries expire after `ttl` seconds; Past `maxsize` entries, the oldest are removed.
+
+    >>> from tempfile import mkdtemp
+    >>> cache = DiskCache(mkdtemp(), maxsize=1, ttl=60)
+    >>> cache.set(('a', 1), {'x': [1, 2]})
+    >>> cache.get(('a', 1))
+    {'x': [1, 2]}
+    >>> cache.set(('b', 2), {})
+    >>> cache.get(('a', 1)) is None
+    True
+    '''
+
+    def __init__(self, dir_path, maxsize=1024, ttl=3600, timer=time):
+        self.dir_path = Path(dir_path)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        digest = sha256(json.dumps(key).encode()).hexdigest()
+        return self.dir_path / f'{digest}.json.gz'
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            if path.stat().st_mtime + self.ttl > self._timer():
+                with gzip.open(path, 'rt', encoding='utf-8') as f:
+                    value = json.load(f)
+                self.hits += 1
+                return value
+        except (OSError, ValueError):
+            # Missing, or a partial file from a crashed worker.
+            pass
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        makedirs(self.dir_path, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_suffix(f'.{getpid()}-{get_ident()}.tmp')
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(value, f)
+        replace(tmp_path, path)
+        self._prune()
+
+    def _prune(self):
+        paths = list(self.dir_path.glob('*.json.gz'))
+        if len(paths) <= self.maxsize:
+            return
+        mtimes = []
+        for path in paths:
+            try:
+                mtimes.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                pass
+        for _, path in sorted(mtimes)[:len(mtimes) - self.maxsize]:
+            path.unlink(missing_ok=True)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'maxsize': self.maxsize, 'ttl': self.ttl}
+
+
+class ResultCache(object):
+    '''
+    A memory cache, and optionally a disk cache behind it.
+    `get_or_set()` also says where the value came from, for cache-status headers.
+
+    >>> cache = ResultCache(TTLCache())
+    >>> cache.get_or_set(('q', 1), lambda: [1, 2])
+    ([1, 2], 'MISS')
+    >>> cache.get_or_set(('q', 1), lambda: [])
+    ([1, 2], 'HIT')
+    '''
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key):
+        '''
+        Returns the value, or None, and the cache status.
+        '''
+        value = self.memory.get(key, _missing)
+        if value is not _missing:
+            return value, 'HIT'
+        if self.disk is not None:
+            value = self.disk.get(key, _missing)
+            if value is not _missing:
+                self.memory.set(key, value)
+                return value, 'DISK'
+        return None, 'MISS'
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def get_or_set(self, key, compute):
+        value, status = self.get(key)
+        if status == 'MISS':
+            value = compute()
+            self.set(key, value)
+        return value, status
+
+    def stats(self):
+        return {
+            'memory': self.memory.stats(),
+            'disk': self.disk.stats() if self.disk is not None else None,
+        }
+
+
+_missing = object()
+_caches_lock = Lock()
+_logger = getLogger(__name__)
+
+
+def get_cache(name):
+    '''
+    Returns the named cache for the current app, creating it on first use.
+    Size and lifetime come from the `<NAME>_CACHE_MAXSIZE` and `<NAME>_CACHE_TTL` config keys.
+    '''
+    caches = current_app.extensions.setdefault('portal_caches', {})
+    if name not in caches:
+        with _caches_lock:
+            if name not in caches:
+                prefix = name.upper()
+                caches[name] = TTLCache(
+                    maxsize=current_app.config[f'{prefix}_CACHE_MAXSIZE'],
+                    ttl=current_app.config[f'{prefix}_CACHE_TTL'])
+    return caches[name]
+
+
+def get_result_cache(name):
+    '''
+    Returns the named ResultCache for the current app, creating it on first use.
+    The memory cache is configured like get_cache(); If `<NAME>_CACHE_DIR` is set,
+    results are also saved there, up to `<NAME>_DISK_CACHE_MAXSIZE` files.
+    '''
+    caches = current_app.extensions.setdefault('portal_caches', {})
+    if name not in caches:
+        with _caches_lock:
+            if name not in caches:
+                prefix = name.upper()
+                config = current_app.config
+                dir_path = config[f'{prefix}_CACHE_DIR']
+                caches[name] = ResultCache(
+                    TTLCache(
+                        maxsize=config[f'{prefix}_CACHE_MAXSIZE'],
+                        ttl=config[f'{prefix}_CACHE_TTL']),
+                    disk=DiskCache(
+                        dir_path,
+                        maxsize=config[f'{prefix}_DISK_CACHE_MAXSIZE'],
+                        ttl=config[f'{prefix}_CACHE_TTL']) if dir_path else None)
+    return caches[name]
+
+
+def get_refreshing_value(name, load, ttl=None):
+    '''
+    Returns the named RefreshingValue for the current app, creating it on first use.
+    Its lifetime comes from the `<NAME>_TTL` config key, unless `ttl` is given.
+    `load` is called with no arguments, possibly on another thread, so should not
+    depend on the request: Use `with app.app_context()` if it needs the app.
+    '''
+    values = current_app.extensions.setdefault('portal_refreshing_values', {})
+    if name not in values:
+        with _caches_lock:
+            if name not in values:
+                values[name] = RefreshingValue(
+                    load, ttl=ttl or current_app.config[f'{name.upper()}_TTL'])
+    return values[name]
@@ -0,0 +1,46 @@
+import pytest
+
+
+class MockResponse():
+    def __init__(self, json_value):
+        self.status_code = 0  # _request requires a status code
+        self.text = 'Logger call requires this'
+        self._json_value = json_value
+
+    def json(self):
+        return self._json_value
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def mock_upstream(mocker):
+    '''
+    Patches requests.Session: `respond` is called with the request's arguments,
+    and returns the JSON of the response. Returns the mock, to check the calls.
+    '''
+    def mock(respond, method='post'):
+        return mocker.patch(
+            f'requests.Session.{method}',
+            side_effect=lambda *args, **kwargs: MockResponse(respond(*args, **kwargs)))
+    return mock
+
+
+@pytest.fixture
+def mock_es_hits(mock_upstream):
+    '''
+    Patches search POSTs to return the sources as hits, on a single page.
+    Scans filter by entity type: Sources without one are in every type.
+    '''
+    def mock(sources):
+        def respond(path, json=None, **kwargs):
+            post_filter = (json or {}).get('post_filter')
+            entity_type = post_filter['term']['entity_type.keyword'] if post_filter else None
+            return {'hits': {'hits': [
+                {'_id': source['uuid'], '_source': source, 'sort': [source['uuid']]}
+                for source in sources
+                if entity_type is None or source.get('entity_type', entity_type) == entity_type
+            ]}}
+        return mock_upstream(respond)
+    return mock
@@ -26,11 +26,77 @@ class DefaultConfig(object):
         '/hubmapconsortium/commons/main/hubmap_commons/21f293b0-globus-groups.json'
     SOFT_ASSAY_ENDPOINT_PATH = 'assaytype'
 
+    # Entity documents are shared across requests for a few minutes,
+    # so a detail page and its JSON, Vitessce, and RUI requests only hit search-api once.
+    ENTITY_CACHE_MAXSIZE = 2048
+    ENTITY_CACHE_TTL = 300  # seconds
+
+    # Each worker keeps one pool of keep-alive connections for all upstream APIs;
+    # Only the groups token varies between requests.
+    HTTP_POOL_CONNECTIONS = 10  # Number of hosts
+    HTTP_POOL_MAXSIZE = 20  # Connections per host
+    HTTP_RETRIES = 2
+    HTTP_RETRY_BACKOFF = 0.3  # seconds
+    # Threads per worker for making independent upstream calls concurrently:
+    UPSTREAM_EXECUTOR_WORKERS = 16
+    # Each of the calls made concurrently after the Globus token exchange:
+    LOGIN_CALL_TIMEOUT = 10  # seconds
+    # Login calls get their own threads, so they never wait behind other upstream calls:
+    LOGIN_EXECUTOR_WORKERS = 8
+
+    # Generated Vitessce confs, keyed by entity uuid, last modified time, parent, and marker:
+    VITESSCE_CONF_CACHE_MAXSIZE = 512
+    VITESSCE_CONF_CACHE_TTL = 86400  # seconds
+    VITESSCE_CONF_CACHE_DIR = None  # Set to also keep confs on disk
+    VITESSCE_CONF_DISK_CACHE_MAXSIZE = 8192
+    VITESSCE_CONF_MAX_AGE = 300  # seconds; Public confs, then revalidated by ETag
+    # Written by etc/qa/find-vis-bugs.py --store, and read before building a conf:
+    VITESSCE_CONF_STORE_DIR = None
+
+    # Served stale while being refreshed in the background:
+    METADATA_DESCRIPTIONS_TTL = 3600  # seconds
+    GLOBUS_GROUPS_TTL = 3600  # seconds; Also sent as max-age
+    SITEMAP_TTL = 86400  # seconds; Also sent as max-age
+    SITEMAP_CHUNK_SIZE = 50000  # URLs per file: The most search engines accept
+    SITEMAP_MAX_URL_BASES = 4  # Request hosts whose rendered files are kept, by recent use
+    # Processed dataset -> raw dataset: After a full scan, only changes are fetched.
+    RAW_DATASET_REDIRECTS_TTL = 600  # seconds
+    RAW_DATASET_REDIRECTS_FULL_SCAN_INTERVAL = 86400  # seconds; Drops unpublished entities
+    # HuBMAP ID -> uuid, and uuid -> next revision, for redirects; Updated like the above.
+    HUBMAP_ID_INDEX_TTL = 600  # seconds
+    HUBMAP_ID_INDEX_FULL_SCAN_INTERVAL = 86400  # seconds
+    # The sitemap and the full scans above are made by one worker and saved here,
+    # and the other workers read them: Relative to the instance folder; None to disable.
+    SCAN_SNAPSHOT_DIR = 'portal-scans'
+
+    # Gene, protein, and cell type lists for the molecular data queries:
+    # One worker downloads them to the snapshot directory, and the others read them from there.
+    # A relative directory is under the instance folder; None to disable.
+    CELLS_VOCABULARY_TTL = 86400  # seconds
+    VOCABULARY_SNAPSHOT_DIR = 'portal-vocabularies'
+
+    # Results of cell expression, cluster, and percentage queries, keyed by the query:
+    CELLS_RESULTS_CACHE_MAXSIZE = 128
+    CELLS_RESULTS_CACHE_TTL = 3600  # seconds
+    CELLS_RESULTS_CACHE_DIR = None  # Set to also keep results on disk
+    CELLS_RESULTS_DISK_CACHE_MAXSIZE = 2048
+    # Cell expression is streamed from the API in pages; Larger results are not cached.
+    CELLS_EXPRESSION_PAGE_SIZE = 10000
+    CELLS_RESULTS_CACHE_MAX_ROWS = 50000
+
+    # Cell type, gene, and protein detail pages:
+    X_MODALITY_CACHE_MAXSIZE = 512
+    X_MODALITY_CACHE_TTL = 3600  # seconds
+    ORGAN_CELL_COUNTS_CACHE_MAXSIZE = 256
+    ORGAN_CELL_COUNTS_CACHE_TTL = 86400  # seconds
+    X_MODALITY_CONCURRENCY = 4  # Organs counted at once, per request
+
     # Everything else should be overridden in app.conf:
 
     ENTITY_API_BASE = 'should-be-overridden'
 
     GROUP_ID = 'should-be-overridden'
+    WORKSPACES_GROUP_ID = 'should-be-overridden'
 
     GATEWAY_ENDPOINT = 'should-be-overridden'
     ELASTICSEARCH_ENDPOINT = 'should-be-overridden'
@@ -0,0 +1,89 @@
+from asyncio import wrap_future
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from os import getpid
+from threading import Lock
+
+from flask import current_app
+
+
+_lock = Lock()
+
+
+class UpstreamExecutor(object):
+    '''
+    A fixed-size thread pool for making independent upstream calls concurrently.
+    Each call runs in a copy of the caller's context, so `current_app`
+    and `request` still work, and gauges are kept for the health endpoint.
+
+    >>> executor = UpstreamExecutor(max_workers=2)
+    >>> executor.submit(pow, 2, 10).result()
+    1024
+    >>> executor.stats()
+    {'max_workers': 2, 'queued': 0, 'in_flight': 0, 'completed': 1}
+    '''
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='upstream')
+        self._lock = Lock()
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+
+    def submit(self, fn, *args, **kwargs):
+        context = copy_context()
+
+        def call():
+            with self._lock:
+                self.queued -= 1
+                self.in_flight += 1
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                    self.completed += 1
+
+        with self._lock:
+            self.queued += 1
+        return self._pool.submit(call)
+
+    async def run(self, fn, *args, **kwargs):
+        '''
+        Like asyncio.to_thread, but on this pool.
+        '''
+        return await wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self):
+        return {
+            'max_workers': self.max_workers,
+            'queued': self.queued,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+        }
+
+
+def get_executor(app, name='upstream'):
+    '''
+    Returns the named executor shared by all requests in this worker,
+    sized by the `<NAME>_EXECUTOR_WORKERS` config key.
+    Threads do not survive a fork, so a new pool is made whenever the process ID changes.
+    '''
+    pid = getpid()
+    key = f'{name}_executor'
+    pid_executor = app.extensions.get(key)
+    if pid_executor is None or pid_executor[0] != pid:
+        with _lock:
+            pid_executor = app.extensions.get(key)
+            if pid_executor is None or pid_executor[0] != pid:
+                pid_executor = (
+                    pid, UpstreamExecutor(app.config[f'{name.upper()}_EXECUTOR_WORKERS']))
+                app.extensions[key] = pid_executor
+    return pid_executor[1]
+
+
+async def run_upstream(fn, *args, **kwargs):
+    # For async views: Use in place of asyncio.to_thread.
+    return await get_executor(current_app).run(fn, *args, **kwargs)
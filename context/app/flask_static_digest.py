@@ -21,6 +21,7 @@ class FlaskStaticDigest(object):
         )
 
         app.add_template_global(self.static_url_for)
+        app.extensions['flask_static_digest'] = self
 
     def static_url_for(self, endpoint, **values):
         """
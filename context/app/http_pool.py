@@ -0,0 +1,96 @@
+from os import getpid
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+_lock = Lock()
+
+
+def make_session(pool_connections=10, pool_maxsize=10, retries=0, backoff_factor=0):
+    '''
+    Returns a keep-alive session which retries failed connections and gateway errors.
+    POSTs to the search and cells APIs are queries, so POSTs are retried too:
+    Requests which create something upstream should use a session without retries.
+
+    >>> session = make_session(pool_maxsize=5, retries=2)
+    >>> adapter = session.get_adapter('https://example.com')
+    >>> adapter._pool_maxsize
+    5
+    >>> adapter.max_retries.total
+    2
+    '''
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=['GET', 'HEAD', 'POST'],
+        # Return the last response, so the caller's error handling still applies.
+        raise_on_status=False)
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(app, retry=True):
+    '''
+    Returns the session shared by all requests in this worker.
+    With `retry=False`, returns a separate shared session which never retries,
+    for requests which create something upstream.
+    uWSGI may fork after the app is created, so sockets are never shared across processes:
+    A new session is made whenever the process ID changes.
+
+    >>> from flask import Flask
+    >>> app = Flask(__name__)
+    >>> app.config.update(HTTP_POOL_CONNECTIONS=1, HTTP_POOL_MAXSIZE=1,
+    ...                   HTTP_RETRIES=2, HTTP_RETRY_BACKOFF=0)
+    >>> get_session(app) is get_session(app)
+    True
+    >>> get_session(app, retry=False).get_adapter('https://example.com').max_retries.total
+    0
+    '''
+    pid = getpid()
+    key = 'http_session' if retry else 'http_no_retry_session'
+    pid_session = app.extensions.get(key)
+    if pid_session is None or pid_session[0] != pid:
+        with _lock:
+            pid_session = app.extensions.get(key)
+            if pid_session is None or pid_session[0] != pid:
+                session = make_session(
+                    pool_connections=app.config['HTTP_POOL_CONNECTIONS'],
+                    pool_maxsize=app.config['HTTP_POOL_MAXSIZE'],
+                    retries=app.config['HTTP_RETRIES'] if retry else 0,
+                    backoff_factor=app.config['HTTP_RETRY_BACKOFF'])
+                pid_session = (pid, session)
+                app.extensions[key] = pid_session
+    return pid_session[1]
+
+
+class UpstreamJSON(object):
+    '''
+    Fetches JSON from a static upstream URL. After the first fetch, if the upstream
+    sent an ETag, it revalidates with If-None-Match, and reuses the previous value on a 304.
+    Intended as the `load` of a RefreshingValue, which provides the TTL and stale-on-error.
+    '''
+
+    def __init__(self, url, app, timeout=10):
+        self.url = url
+        self.app = app
+        self.timeout = timeout
+        self._etag = None
+        self._value = None
+
+    def __call__(self):
+        headers = {'If-None-Match': self._etag} if self._etag else {}
+        response = get_session(self.app).get(self.url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return self._value
+        response.raise_for_status()
+        self._value = response.json()
+        self._etag = response.headers.get('ETag')
+        return self._value
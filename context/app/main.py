@@ -5,6 +5,8 @@ from . import (
     routes_auth, routes_cells, routes_markdown, routes_notebooks,
     routes_workspaces, routes_cell_types, default_config)
 from .flask_static_digest import FlaskStaticDigest
+from .organs import OrganRegistry
+from .warmup import init_warmup
 flask_static_digest = FlaskStaticDigest()
 
 
@@ -56,12 +58,18 @@ def create_app(testing=False):
     app.config.from_object(default_config.DefaultConfig)
     if testing:
         app.config['TESTING'] = True
+        # Tests should not read or write snapshots left by the dev server.
+        app.config['VOCABULARY_SNAPSHOT_DIR'] = None
+        app.config['SCAN_SNAPSHOT_DIR'] = None
     else:
         # We should not load the gitignored app.conf during tests.
         app.config.from_pyfile('app.conf')
 
     flask_static_digest.init_app(app)
 
+    # Organ pages are file-based: Parse the YAML once, rather than on every request.
+    app.extensions['organ_registry'] = OrganRegistry(reload=app.debug)
+
     app.register_blueprint(routes_main.blueprint)
     app.register_blueprint(routes_browse.blueprint)
     app.register_blueprint(routes_api.blueprint)
@@ -113,13 +121,17 @@ def create_app(testing=False):
                 workspaces_token='',
                 user_groups=[])
 
-    # TODO: This breaks cypress tests; the caching will still occur on first lookup
-    # TODO: Investigate how to work around the cypress issue.
-    # Preload the cells api data for the molecular data queries on server start
-    # @app.before_request
-    # def preload_cells():
-    #     if not testing:
-    #         routes_cells.preload_cells_api(app)
+    # Preload the cells api data for the molecular data queries, the sitemap,
+    # and the indexes for redirects on server start.
+    # This runs on a background thread, so requests (and cypress tests) do not wait for it;
+    # Until it finishes, the caching will still occur on first lookup.
+    if not testing:
+        init_warmup(app, {
+            'cells_api': routes_cells.preload_cells_api,
+            'sitemap': routes_browse.get_sitemap,
+            'raw_dataset_redirects': routes_browse.preload_raw_dataset_redirects,
+            'hubmap_id_index': routes_browse.preload_hubmap_id_index,
+        })
 
     return app
 
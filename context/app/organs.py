@@ -0,0 +1,82 @@
+from os.path import dirname
+from pathlib import Path
+from threading import Lock
+
+from yaml import safe_load
+
+
+def normalize_organ_name(name):
+    '''
+    Remove all spaces, underscores, and any text in parentheses.
+
+    >>> normalize_organ_name('  Kidney (Left) ')
+    'kidney'
+    >>> normalize_organ_name('Blood_Vasculature')
+    'blood-vasculature'
+    '''
+    normalized_name = name.lower().strip()
+    return normalized_name.split('(')[0].strip().replace(' ', '-').replace('_', '-')
+
+
+class OrganRegistry(object):
+    '''
+    The organ YAML files, parsed once and indexed by name and search term.
+    The returned organ dicts are shared, and should not be modified.
+    With `reload=True` (for debug), files are re-read when they change on disk.
+
+    >>> registry = OrganRegistry()
+    >>> registry.find('Kidney (Left)')['name']
+    'Kidney'
+    >>> registry.find('blah') is None
+    True
+    >>> registry.find_key_by_search_term('Kidney (Right)')
+    'kidney'
+    '''
+
+    def __init__(self, dir_path=Path(dirname(__file__)) / 'organ', reload=False):
+        self.dir_path = dir_path
+        self.reload = reload
+        self._lock = Lock()
+        self._snapshot = self._load()
+
+    def _mtimes(self):
+        return {p: p.stat().st_mtime for p in self.dir_path.glob('*.yaml')}
+
+    def _load(self):
+        mtimes = self._mtimes()
+        organs = {p.stem: safe_load(p.read_text()) for p in sorted(mtimes)}
+        names = {k: k for k in organs}
+        search_terms = {}
+        # Add search field for each organ as additional keys
+        for k, v in organs.items():
+            for s in v.get('search') or []:
+                names[s.lower()] = k
+                search_terms.setdefault(s, k)
+        return _Snapshot(mtimes=mtimes, organs=organs, names=names, search_terms=search_terms)
+
+    def _get_snapshot(self):
+        if self.reload and self._mtimes() != self._snapshot.mtimes:
+            with self._lock:
+                self._snapshot = self._load()
+        return self._snapshot
+
+    @property
+    def organs(self):
+        return self._get_snapshot().organs
+
+    def find(self, name):
+        snapshot = self._get_snapshot()
+        key = snapshot.names.get(normalize_organ_name(name))
+        return snapshot.organs.get(key)
+
+    def find_key_by_search_term(self, term):
+        return self._get_snapshot().search_terms.get(term)
+
+
+class _Snapshot(object):
+    # Swapped as a whole on reload, so readers never see a partial update.
+    def __init__(self, mtimes, organs, names, search_terms):
+        self.mtimes = mtimes
+        self.organs = organs
+        self.names = names
+        self.search_terms = search_terms
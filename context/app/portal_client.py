@@ -0,0 +1,193 @@
+import json
+from copy import deepcopy
+from hashlib import sha256
+
+import requests
+from flask import abort, current_app
+from hubmap_api_py_client import Client
+from hubmap_api_py_client.errors import ClientError
+from hubmap_api_py_client.internal import InternalClient
+from portal_visualization.client import (
+    ApiClient, _flatten_sources, _get_entity_from_hits, _get_hits, _make_query)
+
+
+def _visibility_class(groups_token):
+    '''
+    Anonymous requests all see the same public documents;
+    each token may see a different set, so it gets its own class.
+
+    >>> _visibility_class('')
+    'public'
+    >>> _visibility_class(None)
+    'public'
+    >>> len(_visibility_class('secret-token'))
+    16
+    '''
+    if not groups_token:
+        return 'public'
+    return sha256(groups_token.encode()).hexdigest()[:16]
+
+
+def _handle_request(session, url, headers=None, body_json=None):
+    # Same error handling as portal_visualization.client._handle_request,
+    # but over a pooled session.
+    try:
+        response = (
+            session.post(url, headers=headers, json=body_json) if body_json
+            else session.get(url, headers=headers)
+        )
+    except requests.exceptions.ConnectTimeout as error:
+        current_app.logger.error(error)
+        abort(504)
+    try:
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as error:
+        current_app.logger.error(error.response.text)
+        status = error.response.status_code
+        if status in [400, 401, 404]:
+            abort(status)
+        raise
+    return response
+
+
+class PortalApiClient(ApiClient):
+    '''
+    ApiClient which sends requests over a shared keep-alive session,
+    and serves entity documents from a shared cache, so that the detail page,
+    its JSON, and its Vitessce conf only fetch each document once.
+    '''
+
+    def __init__(self, entity_cache=None, session=None, **kwargs):
+        super().__init__(**kwargs)
+        self.entity_cache = entity_cache
+        self.session = session or requests.Session()
+
+    def _request(self, url, body_json=None):
+        headers = self._get_headers()
+        response = _handle_request(self.session, url, headers, body_json)
+        # HuBMAP APIs will redirect to s3 if the response payload over 10 MB.
+        if response.status_code in [303]:
+            s3_resp = _handle_request(self.session, response.content).content
+            return json.loads(s3_resp)
+        return response.json()
+
+    def _file_request(self, url):
+        headers = self._get_headers()
+        if self.groups_token:
+            url += f'?token={self.groups_token}'
+        return _handle_request(self.session, url, headers).text
+
+    def get_entities_page(
+            self, plural_lc_entity_type=None, non_metadata_fields=[],
+            constraints={}, uuids=[], size=1000, after=None, metadata_fields=None,
+            query_override=None):
+        '''
+        Returns one page of flattened entities in uuid order,
+        and the uuid to pass as `after` for the next page, or None if this is the last.
+        If `metadata_fields` is given, only those metadata fields are requested.
+        As with get_entities(), `query_override` replaces `constraints` and `uuids`.
+        Unlike get_entities(), missing keys are not filled in.
+        '''
+        entity_type = plural_lc_entity_type[:-1].capitalize()
+        if metadata_fields is None:
+            metadata_include = ['mapped_metadata', 'metadata']
+        else:
+            metadata_include = [
+                f'{root}.{field}' for field in metadata_fields
+                for root in ['mapped_metadata', 'metadata', 'metadata.metadata']]
+        query = {
+            'size': size,
+            'post_filter': {'term': {'entity_type.keyword': entity_type}},
+            'query': query_override or _make_query(constraints, uuids),
+            '_source': {
+                'include': [*non_metadata_fields, *metadata_include],
+                'exclude': ['*.files'],
+            },
+            'sort': [{'uuid.keyword': 'asc'}],
+        }
+        if after is not None:
+            query['search_after'] = [after]
+        hits = _get_hits(self._request(self.elasticsearch_url, body_json=query))
+        entities = _flatten_sources([hit['_source'] for hit in hits], non_metadata_fields)
+        next_after = hits[-1]['sort'][0] if hits and len(hits) == size else None
+        return entities, next_after
+
+    def iter_entities(self, page_size=1000, **kwargs):
+        '''
+        Like get_entities(), but pages through the results with get_entities_page(),
+        yielding one entity at a time: There is no 10k limit,
+        and only one page is held in memory.
+        '''
+        after = None
+        while True:
+            entities, after = self.get_entities_page(size=page_size, after=after, **kwargs)
+            yield from entities
+            if after is None:
+                return
+
+    def iter_dataset_uuids(self, page_size=10000):
+        '''
+        Like get_all_dataset_uuids(), but pages through the results in uuid order,
+        so there is no 10k limit.
+        '''
+        after = None
+        while True:
+            query = {
+                'size': page_size,
+                'post_filter': {'term': {'entity_type.keyword': 'Dataset'}},
+                '_source': False,
+                'sort': [{'uuid.keyword': 'asc'}],
+            }
+            if after is not None:
+                query['search_after'] = after
+            hits = _get_hits(self._request(self.elasticsearch_url, body_json=query))
+            for hit in hits:
+                yield hit['_id']
+            if len(hits) < page_size:
+                return
+            after = hits[-1]['sort']
+
+    def get_entity_ids(self, hbm_id):
+        '''
+        Like get_entity(hbm_id=...), with the same errors, but only returns
+        the uuid and entity_type, rather than the whole document.
+        '''
+        query = {
+            'query': {'match': {'hubmap_id.keyword': hbm_id}},
+            '_source': ['uuid', 'entity_type'],
+        }
+        hits = _get_hits(self._request(self.elasticsearch_url, body_json=query))
+        entity = _get_entity_from_hits(hits, has_token=self.groups_token, hbm_id=hbm_id)
+        return entity['uuid'], entity['entity_type']
+
+    def get_entity(self, uuid=None, hbm_id=None):
+        if self.entity_cache is None:
+            return super().get_entity(uuid=uuid, hbm_id=hbm_id)
+        key = (uuid, hbm_id, _visibility_class(self.groups_token))
+        entity = self.entity_cache.get_or_set(
+            key, lambda: super(PortalApiClient, self).get_entity(uuid=uuid, hbm_id=hbm_id))
+        # Callers are free to modify what they get back.
+        return deepcopy(entity)
+
+
+class _SessionInternalClient(InternalClient):
+    def __init__(self, base_url, session):
+        super().__init__(base_url)
+        self.session = session
+
+    def _post_and_get_results(self, url, request_dict):
+        response = self.session.post(url, request_dict)
+        response_json = response.json()
+        if 'results' not in response_json:
+            raise ClientError(response_json['message'])
+        return response_json['results']
+
+
+class CellsClient(Client):
+    '''
+    Cells API client which sends requests over a shared keep-alive session.
+    '''
+
+    def __init__(self, base_url, session=None):
+        super().__init__(base_url)
+        self.client = _SessionInternalClient(base_url, session or requests.Session())
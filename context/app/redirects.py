@@ -0,0 +1,275 @@
+from abc import ABC, abstractmethod
+from itertools import chain
+import json
+from sys import intern
+from threading import Lock
+from time import monotonic
+
+from .utils import should_redirect_entity
+
+
+def is_raw_dataset(entity):
+    '''
+    The same test as find_raw_dataset_ancestor() makes in its query.
+
+    >>> is_raw_dataset({'processing': 'raw', 'ancestor_counts.entity_type.Dataset': None})
+    True
+    >>> is_raw_dataset({'processing': 'raw', 'ancestor_counts.entity_type.Dataset': 1})
+    False
+    '''
+    return (
+        entity.get('processing') == 'raw'
+        and entity.get('ancestor_counts.entity_type.Dataset') is None)
+
+
+class _ScannedIndex(ABC):
+    '''
+    An index of public entities, filled from a scan of all of them,
+    then updated with the ones modified since the last scan.
+    Entities which are deleted or unpublished do not show up as modified,
+    so after `full_scan_interval` seconds, a new index is built from a full scan instead.
+
+    >>> class FakeClient():
+    ...     def iter_entities(self, plural_lc_entity_type, **kwargs):
+    ...         return self.donors if plural_lc_entity_type == 'donors' else []
+    >>> client = FakeClient()
+    >>> client.donors = [
+    ...     {'uuid': 'a', 'hubmap_id': 'HBM1', 'entity_type': 'Donor'},
+    ...     {'uuid': 'b', 'hubmap_id': 'HBM2', 'entity_type': 'Donor'}]
+    >>> now = [0]
+    >>> index = HubmapIdIndex(timer=lambda: now[0]).refresh(client, full_scan_interval=100)
+    >>> len(index)
+    2
+    >>> client.donors = client.donors[1:]  # "a" is unpublished.
+    >>> index.refresh(client, full_scan_interval=100) is index
+    True
+    >>> index.get('HBM1')
+    ('a', 'Donor')
+    >>> now[0] = 100
+    >>> new_index = index.refresh(client, full_scan_interval=100)
+    >>> new_index.get('HBM1') is None, new_index.get('HBM2')
+    (True, ('b', 'Donor'))
+
+    With a SnapshotStore, one worker makes the full scan, and the others read it:
+
+    >>> from tempfile import mkdtemp
+    >>> from .snapshots import SnapshotStore
+    >>> snapshots = SnapshotStore(mkdtemp(), source='fake', ttl=100)
+    >>> HubmapIdIndex().refresh(client, snapshots=snapshots).get('HBM2')
+    ('b', 'Donor')
+    >>> client.donors = []
+    >>> HubmapIdIndex().refresh(client, snapshots=snapshots).get('HBM2')
+    ('b', 'Donor')
+    '''
+
+    plural_lc_entity_types = []
+    fields = []
+    page_size = 1000
+
+    def __init__(self, timer=monotonic):
+        self._lock = Lock()
+        self._timer = timer
+        self.last_modified = None
+        self.full_scan_time = None
+
+    @abstractmethod
+    def update(self, entities):
+        '''
+        Adds the entities to the index, replacing any earlier versions.
+        '''
+
+    def _update_last_modified(self, entity):
+        timestamp = entity.get('last_modified_timestamp')
+        if timestamp is not None and (
+                self.last_modified is None or timestamp > self.last_modified):
+            self.last_modified = timestamp
+
+    def refresh(self, client, full_scan_interval=None, snapshots=None):
+        '''
+        Returns this index, updated with the entities modified since the last scan,
+        or, if it is time for a full scan, a new index, to be swapped in for this one.
+        If `snapshots` is a SnapshotStore, full scans are shared through it.
+        '''
+        now = self._timer()
+        if self.full_scan_time is not None and (
+                full_scan_interval is None or now < self.full_scan_time + full_scan_interval):
+            # One update for all pages, since entities may refer to ones on later pages.
+            self.update(_iter_modified_since(
+                client, self.plural_lc_entity_types, self.fields,
+                self.last_modified, self.page_size))
+            return self
+        index = type(self)(timer=self._timer)
+        index.update(self._iter_full_scan(client, snapshots))
+        index.full_scan_time = now
+        return index
+
+    def _iter_full_scan(self, client, snapshots):
+        entities = _iter_modified_since(
+            client, self.plural_lc_entity_types, self.fields, None, self.page_size)
+        if snapshots is None:
+            return entities
+        # JSON has no raw newlines, so each entity is one line of the snapshot.
+        # The snapshot may be older than this scan would be,
+        # but the next update fetches everything modified since.
+        lines = snapshots.load(type(self).__name__, lambda: map(json.dumps, entities))
+        return map(json.loads, lines)
+
+
+class RawDatasetRedirects(_ScannedIndex):
+    '''
+    Maps processed datasets, components, and supports to the raw dataset they redirect to,
+    so that following a link to one does not need a search for its ancestor.
+
+    >>> redirects = RawDatasetRedirects()
+    >>> redirects.update([
+    ...     {'uuid': 'raw', 'entity_type': 'Dataset', 'processing': 'raw',
+    ...      'last_modified_timestamp': 1},
+    ...     {'uuid': 'processed', 'hubmap_id': 'HBM123', 'entity_type': 'Dataset',
+    ...      'processing': 'processed', 'pipeline': 'Salmon', 'status': 'Published',
+    ...      'ancestor_ids': ['sample', 'raw'], 'last_modified_timestamp': 2}])
+    >>> redirects.get('processed')
+    {'uuid': 'raw', 'hubmap_id': 'HBM123', 'pipeline': 'Salmon', 'status': 'Published'}
+    >>> redirects.get('raw') is None
+    True
+    >>> redirects.last_modified
+    2
+    '''
+
+    plural_lc_entity_types = ['datasets', 'supports']
+    fields = [
+        'uuid', 'hubmap_id', 'entity_type', 'processing', 'is_component',
+        'pipeline', 'status', 'ancestor_ids', 'ancestor_counts.entity_type.Dataset',
+        'last_modified_timestamp']
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._raw_uuids = set()
+        self._targets = {}
+
+    def __len__(self):
+        return len(self._targets)
+
+    def get(self, uuid):
+        return self._targets.get(uuid)
+
+    def update(self, entities):
+        entities = list(entities)
+        with self._lock:
+            for entity in entities:
+                if is_raw_dataset(entity):
+                    self._raw_uuids.add(entity['uuid'])
+            for entity in entities:
+                target = self._make_target(entity)
+                if target is None:
+                    self._targets.pop(entity['uuid'], None)
+                else:
+                    self._targets[entity['uuid']] = target
+                self._update_last_modified(entity)
+
+    def _make_target(self, entity):
+        if not should_redirect_entity(entity):
+            return None
+        raw_uuid = next(
+            (uuid for uuid in entity.get('ancestor_ids') or [] if uuid in self._raw_uuids),
+            None)
+        if raw_uuid is None:
+            # Not found in the index: Let the request search for it.
+            return None
+        return {
+            'uuid': raw_uuid,
+            'hubmap_id': entity.get('hubmap_id'),
+            'pipeline': entity.get('pipeline'),
+            'status': entity.get('status'),
+        }
+
+
+class HubmapIdIndex(_ScannedIndex):
+    '''
+    HuBMAP ID -> (uuid, entity_type), and uuid -> next revision uuid, for all public entities,
+    so that redirects by HuBMAP ID or to the latest revision do not need to fetch documents.
+    A new revision may be indexed without its previous revision being modified,
+    so links are also taken from the new revision's previous_revision_uuid.
+
+    >>> index = HubmapIdIndex()
+    >>> index.update([
+    ...     {'uuid': 'v1', 'hubmap_id': 'HBM123', 'entity_type': 'Dataset',
+    ...      'next_revision_uuid': 'v2'},
+    ...     {'uuid': 'v2', 'hubmap_id': 'HBM456', 'entity_type': 'Dataset',
+    ...      'next_revision_uuid': 'v3'}])
+    >>> index.get('HBM123')
+    ('v1', 'Dataset')
+    >>> index.get_latest_uuid('v1')  # v3 is not public.
+    'v2'
+    >>> index.get_latest_uuid('unknown') is None
+    True
+    >>> index.update([
+    ...     {'uuid': 'v3', 'hubmap_id': 'HBM789', 'entity_type': 'Dataset',
+    ...      'previous_revision_uuid': 'v2'}])
+    >>> index.get_latest_uuid('v1')
+    'v3'
+    '''
+
+    plural_lc_entity_types = [
+        'donors', 'samples', 'datasets', 'supports', 'collections', 'publications']
+    fields = [
+        'uuid', 'hubmap_id', 'entity_type', 'next_revision_uuid', 'previous_revision_uuid',
+        'last_modified_timestamp']
+    page_size = 10000
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._by_hubmap_id = {}
+        self._next_revisions = {}
+        # From previous_revision_uuid: These take precedence.
+        self._newer_revisions = {}
+
+    def __len__(self):
+        return len(self._by_hubmap_id)
+
+    def get(self, hubmap_id):
+        return self._by_hubmap_id.get(hubmap_id)
+
+    def _get_next_uuid(self, uuid):
+        return self._newer_revisions.get(uuid) or self._next_revisions.get(uuid)
+
+    def get_latest_uuid(self, uuid):
+        '''
+        Follows next revisions while they are public; None if the uuid is not in the index.
+        '''
+        if uuid not in self._next_revisions:
+            return None
+        seen = {uuid}
+        while True:
+            next_uuid = self._get_next_uuid(uuid)
+            if next_uuid not in self._next_revisions or next_uuid in seen:
+                return uuid
+            uuid = next_uuid
+            seen.add(uuid)
+
+    def update(self, entities):
+        with self._lock:
+            for entity in entities:
+                uuid = entity['uuid']
+                if entity.get('hubmap_id'):
+                    # Intern, since most types repeat.
+                    self._by_hubmap_id[entity['hubmap_id']] = (
+                        uuid, intern(entity['entity_type']))
+                self._next_revisions[uuid] = entity.get('next_revision_uuid')
+                if entity.get('previous_revision_uuid'):
+                    self._newer_revisions[entity['previous_revision_uuid']] = uuid
+                self._update_last_modified(entity)
+
+
+def _iter_modified_since(client, plural_lc_entity_types, fields, last_modified, page_size):
+    # Everything, the first time; After that, only what has changed.
+    query_override = None
+    if last_modified is not None:
+        query_override = {'range': {'last_modified_timestamp': {'gte': last_modified}}}
+    return chain.from_iterable(
+        client.iter_entities(
+            page_size=page_size,
+            plural_lc_entity_type=plural_lc_entity_type,
+            non_metadata_fields=fields,
+            metadata_fields=[],
+            query_override=query_override)
+        for plural_lc_entity_type in plural_lc_entity_types)
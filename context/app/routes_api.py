@@ -1,13 +1,16 @@
-from functools import cache
 from io import StringIO
 from csv import DictWriter
 from datetime import datetime
+from tempfile import SpooledTemporaryFile
+import json
+import zlib
 
-import requests
+from flask import (
+    Response, abort, request, render_template, jsonify, current_app, stream_with_context)
 
-from flask import Response, abort, request, render_template, jsonify, current_app
-
-from .utils import make_blueprint, get_client, get_default_flask_data
+from .caching import get_refreshing_value
+from .utils import (
+    make_blueprint, get_client, get_public_client, get_default_flask_data, get_upstream_json)
 
 
 blueprint = make_blueprint(__name__)
@@ -44,15 +47,33 @@ def _extract_uuids_and_constraints(all_args, use_list=False):
 
 
 def _get_recent_description(descriptions):
+    '''
+    >>> _get_recent_description([
+    ...   {'source': 'HMFIELD', 'description': 'old'},
+    ...   {'source': 'CEDAR', 'description': 'preferred'}])
+    'preferred'
+    '''
     cedar_descriptions = [d for d in descriptions if d['source'] == "CEDAR"]
     return (cedar_descriptions if cedar_descriptions else descriptions)[0]['description']
 
 
+def _load_metadata_descriptions(app):
+    with app.app_context():
+        field_descriptions = get_public_client().get_metadata_descriptions()
+    return {d['name']: _get_recent_description(d['descriptions']) for d in field_descriptions}
+
+
+def _get_metadata_descriptions():
+    # Descriptions rarely change: Share one dict across requests, and refresh in the background.
+    # The dict is shared, so it should not be modified.
+    app = current_app._get_current_object()
+    return get_refreshing_value(
+        'metadata_descriptions', lambda: _load_metadata_descriptions(app)).get()
+
+
 @blueprint.route('/metadata/descriptions', methods=['GET'])
 def metadata_descriptions():
-    client = get_client()
-    field_descriptions = client.get_metadata_descriptions()
-    return {d['name']: _get_recent_description(d['descriptions']) for d in field_descriptions}
+    return _get_metadata_descriptions()
 
 
 @blueprint.route('/metadata/v0/<entity_type>.tsv', methods=['GET', 'POST'])
@@ -68,27 +89,37 @@ def entities_tsv(entity_type):
             return _get_api_json_error(400, 'POST only accepts uuids in JSON body.')
         constraints = {}
         uuids = body.get('uuids')
-    entities = _get_entities(entity_type, constraints, uuids)
+    extra_fields = _get_extra_fields(entity_type)
+    descriptions_dict = _get_metadata_descriptions()
+    client = get_client()
 
-    descriptions_dict = metadata_descriptions()
-    tsv = _dicts_to_tsv(entities, _first_fields, descriptions_dict)
+    entities = client.iter_entities(
+        plural_lc_entity_type=entity_type, non_metadata_fields=extra_fields,
+        constraints=constraints, uuids=uuids, page_size=_tsv_page_size)
+
+    # Rows are streamed, so the columns need to be known up front:
+    # The entities are fetched once, and spooled, rather than all held in memory.
+    spool, body_fields = _spool_entities(entities, _first_fields)
+    tsv_lines = _iter_tsv(
+        _iter_spooled(spool), _first_fields, body_fields, descriptions_dict)
 
     timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
     filename = f'hubmap-{entity_type}-metadata-{timestamp}.tsv'
 
-    return _make_tsv_response(tsv, filename)
+    response = _make_tsv_response(tsv_lines, filename)
+    # Also if the client disconnects before the rows are read.
+    response.call_on_close(spool.close)
+    return response
 
 
 @blueprint.route('/lineup/<entity_type>')
 def lineup(entity_type):
-    all_args = request.args.to_dict(flat=False)
-    uuids, constraints = _extract_uuids_and_constraints(all_args)
-
-    entities = _get_entities(entity_type, constraints, uuids)
-    entities.sort(key=lambda e: e['uuid'])
+    # Only the first page is embedded in the HTML: The rest is fetched from lineup_json.
+    page = _get_lineup_page(entity_type)
     flask_data = {
         **get_default_flask_data(),
-        'entities': entities
+        'entities': page['entities'],
+        'lineup_next': page['next']
     }
     return render_template(
         'base-pages/react-content.html',
@@ -97,13 +128,46 @@ def lineup(entity_type):
     )
 
 
+@blueprint.route('/lineup/<entity_type>.json')
+def lineup_json(entity_type):
+    return _get_lineup_page(entity_type)
+
+
+_lineup_page_size = 500
+_lineup_page_args = ['after', 'size', 'fields']
+
+
+def _get_lineup_page(entity_type):
+    '''
+    Accepts the same arguments as the lineup page, plus:
+    - after: The "next" uuid from the previous page.
+    - size: Page size.
+    - fields: Comma-separated metadata fields to include; By default, all are included.
+    '''
+    all_args = _drop_dict_keys(request.args.to_dict(flat=False), _lineup_page_args)
+    uuids, constraints = _extract_uuids_and_constraints(all_args)
+    # Search-api returns at most 10k hits, and an empty page has no "next".
+    size = max(1, min(request.args.get('size', _lineup_page_size, type=int), 10000))
+    fields = request.args.get('fields')
+    extra_fields = _get_extra_fields(entity_type)
+    if fields is not None:
+        fields = fields.split(',')
+        extra_fields = [f for f in extra_fields if f in _first_fields or f in fields]
+    entities, next_after = get_client().get_entities_page(
+        plural_lc_entity_type=entity_type, non_metadata_fields=extra_fields,
+        constraints=constraints, uuids=uuids,
+        size=size, after=request.args.get('after'), metadata_fields=fields)
+    return {'entities': entities, 'next': next_after}
+
+
 _first_fields = ['uuid', 'hubmap_id']
+_tsv_page_size = 1000
+_tsv_spool_max_size = 10 * 1024 * 1024  # bytes
 
 
-def _get_entities(entity_type, constraints={}, uuids=None):
+def _get_extra_fields(entity_type):
     if entity_type not in ['donors', 'samples', 'datasets']:
         abort(404)
-    client = get_client()
     extra_fields = _first_fields[:]
     extra_fields += [
         # Version number is not in document:
@@ -139,31 +203,95 @@ def _get_entities(entity_type, constraints={}, uuids=None):
         extra_fields += ['donor.hubmap_id', 'origin_samples_unique_mapped_organs']
     if entity_type in ['samples']:
         extra_fields += ['sample_category']
-    entities = client.get_entities(
-        plural_lc_entity_type=entity_type, non_metadata_fields=extra_fields,
-        constraints=constraints,
-        uuids=uuids
-        # Default "True" would throw away repeated keys after the first.
-    )
-    return entities
+    return extra_fields
 
 
-def _make_tsv_response(tsv_content, filename):
+def _make_tsv_response(tsv_lines, filename):
+    headers = {'Content-Disposition': f"attachment; filename={filename}"}
+    chunks = _join_chunks(tsv_lines)
+    if 'gzip' in request.accept_encodings:
+        chunks = _gzip_chunks(chunks)
+        headers.update({'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
     return Response(
-        response=tsv_content,
-        headers={'Content-Disposition': f"attachment; filename={filename}"},
+        response=stream_with_context(chunks),
+        headers=headers,
         mimetype='text/tab-separated-values'
     )
 
 
-def _dicts_to_tsv(data_dicts, first_fields, descriptions_dict):
+def _join_chunks(lines, chunk_size=64 * 1024):
+    '''
+    Fewer, larger writes are cheaper for the server than one per row.
+
+    >>> list(_join_chunks(['ab', 'cd', 'ef', 'g'], chunk_size=4))
+    ['abcd', 'efg']
+    '''
+    buffer = []
+    buffer_size = 0
+    for line in lines:
+        buffer.append(line)
+        buffer_size += len(line)
+        if buffer_size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            buffer_size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _gzip_chunks(chunks):
+    '''
+    >>> import gzip
+    >>> gzip.decompress(b''.join(_gzip_chunks(['hello ', 'world'])))
+    b'hello world'
+    '''
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _spool_entities(data_dicts, first_fields):
+    '''
+    Writes the dicts to a temporary file, one JSON line each, and returns the file,
+    rewound, with the sorted union of their keys, other than the first fields.
+    Small results stay in memory; Larger ones go to disk.
+
+    >>> spool, body_fields = _spool_entities(iter([{'a': 1, 'c': 2}, {'b': 3, 'a': 4}]), ['a'])
+    >>> body_fields
+    ['b', 'c']
+    >>> list(_iter_spooled(spool))
+    [{'a': 1, 'c': 2}, {'b': 3, 'a': 4}]
+    '''
+    spool = SpooledTemporaryFile(max_size=_tsv_spool_max_size, mode='w+')
+    keys = set()
+    try:
+        for dd in data_dicts:
+            keys.update(dd.keys())
+            spool.write(json.dumps(dd) + '\n')
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, sorted(keys - set(first_fields))
+
+
+def _iter_spooled(spool):
+    with spool:
+        for line in spool:
+            yield json.loads(line)
+
+
+def _iter_tsv(data_dicts, first_fields, body_fields, descriptions_dict):
     '''
     >>> data_dicts = [
     ...   # explicit subtitle
     ...   {'title': 'Star Wars', 'subtitle': 'A New Hope', 'date': '1977'},
     ...   # empty subtitle
     ...   {'title': 'The Empire Strikes Back', 'subtitle': '', 'date': '1980'},
-    ...   # N/A subtitle
+    ...   # missing subtitle
     ...   {'title': 'Return of the Jedi', 'date': '1983'}
     ... ]
     >>> descriptions_dict = {
@@ -171,39 +299,45 @@ def _dicts_to_tsv(data_dicts, first_fields, descriptions_dict):
     ...   'date': 'date released',
     ...   'extra': 'should be ignored'
     ... }
-    >>> lines = _dicts_to_tsv(data_dicts, ['title'], descriptions_dict).split('\\r\\n')
+    >>> lines = ''.join(
+    ...   _iter_tsv(data_dicts, ['title'], ['date', 'subtitle'], descriptions_dict)
+    ... ).split('\\r\\n')
     >>> for line in lines:
     ...   print('| ' + ' | '.join(line.split('\\t')) + ' |')
     | title | date | subtitle |
     | #main title | date released |  |
     | Star Wars | 1977 | A New Hope |
     | The Empire Strikes Back | 1980 |  |
-    | Return of the Jedi | 1983 | N/A |
+    | Return of the Jedi | 1983 |  |
     |  |
     '''
-    # wrap in default dicts that return 'n/a'
-    body_fields = sorted(
-        set().union(*[d.keys() for d in data_dicts])
-        - set(first_fields)
-    )
-    for dd in data_dicts:
-        for field in body_fields:
-            if field not in dd:
-                dd[field] = 'N/A'
     output = StringIO()
+
+    def pop_line(prefix=''):
+        line = prefix + output.getvalue()
+        output.seek(0)
+        output.truncate()
+        return line
+
     writer = DictWriter(output, first_fields + body_fields, delimiter='\t', extrasaction='ignore')
     writer.writeheader()
-    writer.writerows([descriptions_dict] + data_dicts)
-    tsv = output.getvalue()
-    tsv_lines = tsv.split('\n')
-    tsv_lines[1] = '#' + tsv_lines[1]
-    return '\n'.join(tsv_lines)
+    yield pop_line()
+    writer.writerow(descriptions_dict)
+    yield pop_line(prefix='#')
+
+    # Missing fields are empty, as when get_entities() filled in missing keys.
+    for dd in data_dicts:
+        writer.writerow(dd)
+        yield pop_line()
 
 
-@cache
 @blueprint.route('/api/globus-groups.json')
 def get_globus_groups():
     # The globus auth helper from hubmap_commons omits the group descriptions,
     # so we need to fetch the full list of groups from the repo.
-    groups = requests.get(current_app.config['GLOBUS_GROUPS_URL']).json()
-    return groups
+    groups = get_upstream_json('globus_groups', current_app.config['GLOBUS_GROUPS_URL'])
+    response = jsonify(groups)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['GLOBUS_GROUPS_TTL']
+    response.add_etag()
+    return response.make_conditional(request)
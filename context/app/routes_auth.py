@@ -1,14 +1,16 @@
 from urllib.parse import urlencode, unquote
 from datetime import datetime
+from time import time
 
 from flask import (
     make_response, current_app, url_for,
     request, redirect, session)
-import requests
 import globus_sdk
 from json import dumps
 from hubmap_commons.hm_auth import AuthHelper
 
+from .executor import get_executor
+from .http_pool import get_session
 from .utils import make_blueprint
 
 
@@ -34,9 +36,9 @@ def get_globus_groups(groups_token):
         'Authorization': 'Bearer ' + groups_token
     }
 
-    response = requests.get(
+    response = get_session(current_app).get(
         'https://groups.api.globus.org/v2/groups/my_groups',
-        headers=headers)
+        headers=headers, timeout=current_app.config['LOGIN_CALL_TIMEOUT'])
 
     response.raise_for_status()
     groups = response.json()
@@ -61,6 +63,80 @@ def log(message):
     current_app.logger.info(f'routes_auth: {message} [IP: {get_ip()}]', extra={})
 
 
+def get_user_email(auth_token):
+    user_info_request_headers = {'Authorization': 'Bearer ' + auth_token}
+    user_info = get_session(current_app).get(
+        'https://auth.globus.org/v2/oauth2/userinfo',
+        headers=user_info_request_headers,
+        timeout=current_app.config['LOGIN_CALL_TIMEOUT']).json()
+    return user_info['email'] if 'email' in user_info else ''
+
+
+def get_hubmap_globus_groups():
+    # Auth Helper cache must be initialized before we can call getHuBMAPGroupInfo()
+    if not AuthHelper.isInitialized():
+        client_id = current_app.config['APP_CLIENT_ID']
+        client_secret = current_app.config['APP_CLIENT_SECRET']
+        AuthHelper.create(client_id, client_secret)
+    else:
+        AuthHelper.instance()
+
+    return list(AuthHelper.getHuBMAPGroupInfo().values())
+
+
+def get_workspaces_token(groups_token):
+    workspaces_post_url = current_app.config['WORKSPACES_ENDPOINT'] + '/tokens/'
+    workspaces_post_data = dumps({'auth_token': groups_token})
+    # This creates a token, so it must not be retried like the shared session's reads.
+    workspaces_post_resp = get_session(current_app, retry=False).post(
+        workspaces_post_url,
+        data=workspaces_post_data,
+        timeout=current_app.config['LOGIN_CALL_TIMEOUT'])
+
+    try:
+        return workspaces_post_resp.json()['token']
+    except Exception as e:
+        if not workspaces_post_resp.ok:
+            current_app.logger.error(
+                'Workspaces auth failed: '
+                f'{workspaces_post_resp.status_code} {workspaces_post_resp.text[:100]}')
+        else:
+            current_app.logger.error(f'Workspaces auth token read failed: {e}')
+        return ''
+
+
+def _timed(step):
+    start = time()
+    result = step()
+    return result, round(time() - start, 3)
+
+
+def run_login_steps(steps, required=()):
+    '''
+    Runs the steps concurrently, and returns their results by name.
+    A step which fails, or does not finish within LOGIN_CALL_TIMEOUT, gets None,
+    so the user is still logged in, if with less information.
+    If a `required` step fails, its error is raised instead, and the login fails:
+    Logging in without it would silently drop the user's permissions.
+    '''
+    # The login pool is only used here, so the deadline is not spent waiting in a queue.
+    executor = get_executor(current_app, 'login')
+    futures = {name: executor.submit(_timed, step) for name, step in steps.items()}
+    deadline = time() + current_app.config['LOGIN_CALL_TIMEOUT']
+    results = {}
+    for name, future in futures.items():
+        try:
+            results[name], seconds = future.result(timeout=max(0, deadline - time()))
+            log(f'{name} ({seconds} seconds)')
+        except Exception as e:
+            current_app.logger.error(f'Login step "{name}" failed: {e!r}')
+            log(f'{name} (failed)')
+            if name in required:
+                raise
+            results[name] = None
+    return results
+
+
 @blueprint.route('/login')
 def login():
     '''
@@ -109,50 +185,32 @@ def login():
     auth_token_object = tokens.by_resource_server['auth.globus.org']
     auth_token = auth_token_object['access_token']
 
-    user_info_request_headers = {'Authorization': 'Bearer ' + auth_token}
-
-    log('6: userinfo')
-    user_info = requests.get('https://auth.globus.org/v2/oauth2/userinfo',
-                             headers=user_info_request_headers).json()
-    user_email = user_info['email'] if 'email' in user_info else ''
-    user_globus_groups = get_globus_groups(groups_token)
-
-    log('7: HuBMAP globus groups')
-    # Auth Helper cache must be initialized before we can call getHuBMAPGroupInfo()
-    if not AuthHelper.isInitialized():
-        client_id = current_app.config['APP_CLIENT_ID']
-        client_secret = current_app.config['APP_CLIENT_SECRET']
-        AuthHelper.create(client_id, client_secret)
-    else:
-        AuthHelper.instance()
-
-    globus_groups = AuthHelper.getHuBMAPGroupInfo().values()
-
     permission_groups = {
         'HuBMAP': current_app.config['GROUP_ID'],
         'Workspaces': current_app.config['WORKSPACES_GROUP_ID']
     }
 
-    workspaces_token = ''  # None would serialize to "None" ... which is no longer false-y.
+    # These calls are independent, so they are made concurrently:
+    # Login takes as long as the slowest, rather than the sum.
+    steps = {
+        '6: userinfo': lambda: get_user_email(auth_token),
+        '6: globus groups': lambda: get_globus_groups(groups_token),
+        '7: HuBMAP globus groups': get_hubmap_globus_groups,
+    }
     if 'HuBMAP' in permission_groups or 'Workspaces' in permission_groups:
         # This could be defered until someone actually tries to access the workspaces, but:
         # - This network request could potentially be slow... Lump it with the other slows.
         # - If you're logged in, you should be logged in all the way... Easier to debug.
-        workspaces_post_url = current_app.config['WORKSPACES_ENDPOINT'] + '/tokens/'
-        workspaces_post_data = dumps({'auth_token': groups_token})
-        workspaces_post_resp = requests.post(
-            workspaces_post_url,
-            data=workspaces_post_data)
-
-        try:
-            workspaces_token = workspaces_post_resp.json()['token']
-        except Exception as e:
-            if not workspaces_post_resp.ok:
-                current_app.logger.error(
-                    'Workspaces auth failed: '
-                    f'{workspaces_post_resp.status_code} {workspaces_post_resp.text[:100]}')
-            else:
-                current_app.logger.error(f'Workspaces auth token read failed: {e}')
+        steps['7: workspaces token'] = lambda: get_workspaces_token(groups_token)
+    # The groups decide the user's permissions: Without them, the login fails.
+    results = run_login_steps(
+        steps, required=['6: globus groups', '7: HuBMAP globus groups'])
+
+    user_email = results['6: userinfo'] or ''
+    user_globus_groups = results['6: globus groups']
+    globus_groups = results['7: HuBMAP globus groups']
+    # None would serialize to "None" ... which is no longer false-y.
+    workspaces_token = results.get('7: workspaces token') or ''
 
     # Determine if the user belongs to any of the groups in the globus groups master list
     user_internal_hubmap_groups = [
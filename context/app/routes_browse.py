@@ -1,12 +1,19 @@
 import json
+from os.path import join
 from urllib.parse import urlparse, quote
 
 from flask import (
-    render_template, jsonify,
+    render_template, jsonify, current_app, session,
     abort, request, redirect, url_for, Response)
 
+from .caching import get_refreshing_value, get_result_cache
+from .portal_client import _visibility_class
+from .redirects import RawDatasetRedirects, HubmapIdIndex
+from .sitemap import Sitemap
+from .snapshots import SnapshotStore
+from .vitessce_confs import build_error_conf, build_vitessce_conf, VitessceConfStore
 from .utils import (
-    get_default_flask_data, make_blueprint, get_client,
+    get_default_flask_data, make_blueprint, get_client, get_public_client,
     get_url_base_from_request, entity_types, find_raw_dataset_ancestor,
     should_redirect_entity)
 
@@ -19,16 +26,24 @@ def hbm_redirect(possible_hbm_id):
     uppercase_possible_hmb_id = possible_hbm_id.upper()
     if not uppercase_possible_hmb_id.startswith('HBM'):
         abort(404)
-    client = get_client()
-    entity = client.get_entity(hbm_id=uppercase_possible_hmb_id)
+    index = _get_loaded_index('hubmap_id_index', HubmapIdIndex)
+    ids = index.get(uppercase_possible_hmb_id) if index is not None else None
+    if ids is None:
+        ids = get_client().get_entity_ids(uppercase_possible_hmb_id)
+    uuid, entity_type = ids
     return redirect(
-        url_for('routes_browse.details', type=entity['entity_type'].lower(), uuid=entity['uuid']))
+        url_for('routes_browse.details', type=entity_type.lower(), uuid=uuid))
 
 
 @blueprint.route('/browse/latest/<type>/<uuid>')
 def latest_redirect(type, uuid):
-    client = get_client()
-    latest_entity_uuid = client.get_latest_entity_uuid(uuid, type)
+    latest_entity_uuid = None
+    # Only public revisions are indexed: Logged-in users may be able to see later ones.
+    if not session.get('groups_token'):
+        index = _get_loaded_index('hubmap_id_index', HubmapIdIndex)
+        latest_entity_uuid = index.get_latest_uuid(uuid) if index is not None else None
+    if latest_entity_uuid is None:
+        latest_entity_uuid = get_client().get_latest_entity_uuid(uuid, type)
     return redirect(
         url_for('routes_browse.details', type=type.lower(), uuid=latest_entity_uuid))
 
@@ -45,6 +60,10 @@ def unknown_ext(type, uuid, unknown_ext):
 def details(type, uuid):
     if type not in entity_types:
         abort(404)
+    target = _get_raw_dataset_redirect(uuid)
+    if target is not None:
+        return _redirect_to_raw_dataset(target)
+
     client = get_client()
     entity = client.get_entity(uuid)
     actual_type = entity['entity_type'].lower()
@@ -52,24 +71,15 @@ def details(type, uuid):
     if (should_redirect_entity(entity)):
         raw_dataset = find_raw_dataset_ancestor(client, entity.get('ancestor_ids'))
 
-        pipeline_anchor = entity.get('pipeline', entity.get('hubmap_id')).replace(' ', '')
-        anchor = quote(f'section-{pipeline_anchor}-{entity.get("status")}').lower()
-
         if raw_dataset is None or len(raw_dataset) == 0:
             abort(404)
 
-        marker = request.args.get('marker') or None
-
-        # Redirect to the primary dataset
-        return redirect(
-            url_for('routes_browse.details',
-                    type='dataset',
-                    uuid=raw_dataset[0].get('uuid'),
-                    _anchor=anchor,
-                    redirected=True,
-                    redirectedFromId=entity.get('hubmap_id'),
-                    redirectedFromPipeline=entity.get('pipeline'),
-                    marker=marker))
+        return _redirect_to_raw_dataset({
+            'uuid': raw_dataset[0].get('uuid'),
+            'hubmap_id': entity.get('hubmap_id'),
+            'pipeline': entity.get('pipeline'),
+            'status': entity.get('status'),
+        })
 
     if type != actual_type:
         return redirect(url_for('routes_browse.details', type=actual_type, uuid=uuid))
@@ -98,6 +108,70 @@ def details(type, uuid):
     )
 
 
+def _redirect_to_raw_dataset(target):
+    pipeline_anchor = (target['pipeline'] or target['hubmap_id']).replace(' ', '')
+    anchor = quote(f'section-{pipeline_anchor}-{target["status"]}').lower()
+
+    marker = request.args.get('marker') or None
+
+    # Redirect to the primary dataset
+    return redirect(
+        url_for('routes_browse.details',
+                type='dataset',
+                uuid=target['uuid'],
+                _anchor=anchor,
+                redirected=True,
+                redirectedFromId=target['hubmap_id'],
+                redirectedFromPipeline=target['pipeline'],
+                marker=marker))
+
+
+def _get_scan_snapshots(app, ttl):
+    # Shared by the workers on a host, so only one of them scans the index.
+    dir_path = app.config['SCAN_SNAPSHOT_DIR']
+    if dir_path is None:
+        return None
+    return SnapshotStore(
+        join(app.instance_path, dir_path),
+        source=app.config['ELASTICSEARCH_ENDPOINT'] + app.config['PORTAL_INDEX_PATH'], ttl=ttl)
+
+
+def _get_index_value(app, name, index_class):
+    if name not in app.extensions:
+        app.extensions[name] = index_class()
+
+    def load():
+        full_scan_interval = app.config[f'{name.upper()}_FULL_SCAN_INTERVAL']
+        with app.app_context():
+            # Either updated in place, or, after a full scan, a new index to swap in.
+            index = app.extensions[name].refresh(
+                get_public_client(),
+                full_scan_interval=full_scan_interval,
+                snapshots=_get_scan_snapshots(app, ttl=full_scan_interval))
+        app.extensions[name] = index
+        return index
+    return get_refreshing_value(name, load)
+
+
+def _get_loaded_index(name, index_class):
+    # The first scan is made by the warm-up: Until it is done, requests fetch as before.
+    value = _get_index_value(current_app, name, index_class)
+    return value.get() if value.is_loaded else None
+
+
+def preload_raw_dataset_redirects(app):
+    _get_index_value(app, 'raw_dataset_redirects', RawDatasetRedirects).get()
+
+
+def preload_hubmap_id_index(app):
+    _get_index_value(app, 'hubmap_id_index', HubmapIdIndex).get()
+
+
+def _get_raw_dataset_redirect(uuid):
+    redirects = _get_loaded_index('raw_dataset_redirects', RawDatasetRedirects)
+    return redirects.get(uuid) if redirects is not None else None
+
+
 @blueprint.route('/browse/<type>/<uuid>.json')
 def details_json(type, uuid):
     if type not in entity_types:
@@ -115,27 +189,57 @@ def details_vitessce(type, uuid):
     entity = client.get_entity(uuid)
     parent_uuid = request.args.get('parent') or None
     marker = request.args.get('marker') or None
-    parent = client.get_entity(parent_uuid) if parent_uuid else None
-    epic_uuid = None
-    if 'segmentation_mask' in entity.get('vitessce-hints') and entity.get(
-            'status') != 'Error':
-        if parent is None:
-            ancestors = entity.get('immediate_ancestor_ids')
-            if len(ancestors) > 0:
-                parent = ancestors[0]
-        if 'epic' in entity.get('vitessce-hints'):
-            epic_uuid = uuid
-
-    vitessce_conf = client.get_vitessce_conf_cells_and_lifted_uuid(
-        entity,
-        marker=marker,
-        parent=parent,
-        epic_uuid=epic_uuid,
-    ).vitessce_conf
+    visibility = _visibility_class(session.get('groups_token'))
+    last_modified = entity.get('last_modified_timestamp')
+    cached, cache_status = None, None
+    store = _get_vitessce_conf_store(current_app)
+    if store is not None and visibility == 'public' and parent_uuid is None and marker is None:
+        # Precomputed by etc/qa/find-vis-bugs.py, if the dataset has not changed since.
+        cached, cache_status = store.get(uuid, last_modified), 'STORE'
+    if cached is None:
+        # The conf only changes when the entity does: Confs for non-public entities
+        # include the token in asset URLs, so they are kept apart.
+        key = (uuid, last_modified, parent_uuid, marker, visibility)
+        try:
+            # Failures raise, rather than returning an error conf, so they are not cached.
+            cached, cache_status = get_result_cache('vitessce_conf').get_or_set(
+                key, lambda: build_vitessce_conf(
+                    client, entity,
+                    parent=client.get_entity(parent_uuid) if parent_uuid else None,
+                    marker=marker, wrap_error=False))
+        except Exception as e:
+            # As before caching, any failure, including an HTTP error for the parent
+            # or the assets, is shown by Vitessce.
+            current_app.logger.exception(f'Building vitessce conf for {uuid} failed')
+            response = jsonify(build_error_conf(e))
+            response.headers.add("Access-Control-Allow-Origin", "*")
+            # The upstream failure may be brief: The next request should try again.
+            response.cache_control.no_store = True
+            return response
+
     # Returns a JSON null if there is no visualization.
-    response = jsonify(vitessce_conf.conf)
+    response = jsonify(cached['conf'])
     response.headers.add("Access-Control-Allow-Origin", "*")
-    return response
+    response.headers['X-Cache'] = cache_status
+    response.set_etag(cached['etag'])
+    if visibility == 'public':
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['VITESSCE_CONF_MAX_AGE']
+        # Only anonymous requests get this: Logged-in requests send the session cookie.
+        response.vary.add('Cookie')
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _get_vitessce_conf_store(app):
+    dir_path = app.config['VITESSCE_CONF_STORE_DIR']
+    if not dir_path:
+        return None
+    if 'vitessce_conf_store' not in app.extensions:
+        app.extensions['vitessce_conf_store'] = VitessceConfStore(dir_path)
+    return app.extensions['vitessce_conf_store']
 
 
 @blueprint.route('/browse/<type>/<uuid>.rui.json')
@@ -154,16 +258,55 @@ def details_rui_json(type, uuid):
     abort(404)
 
 
+def _load_sitemap(app):
+    with app.app_context():
+        uuids = get_public_client().iter_dataset_uuids()
+        snapshots = _get_scan_snapshots(app, ttl=app.config['SITEMAP_TTL'])
+        if snapshots is not None:
+            uuids = snapshots.load('sitemap', lambda: uuids)
+        return Sitemap(
+            uuids,
+            chunk_size=app.config['SITEMAP_CHUNK_SIZE'],
+            max_url_bases=app.config['SITEMAP_MAX_URL_BASES'])
+
+
+def get_sitemap(app):
+    # Crawlers should not trigger a full scan of the index:
+    # The sitemap is regenerated in the background after SITEMAP_TTL.
+    return get_refreshing_value('sitemap', lambda: _load_sitemap(app)).get()
+
+
+def _sitemap_response(name, mimetype):
+    sitemap = get_sitemap(current_app)
+    sitemap_file = sitemap.get_file(get_url_base_from_request(), name)
+    if sitemap_file is None:
+        abort(404)
+    if 'gzip' in request.accept_encodings:
+        response = Response(sitemap_file.gzipped, mimetype=mimetype)
+        response.content_encoding = 'gzip'
+    else:
+        response = Response(sitemap_file.body, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    response.last_modified = sitemap.generated
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['SITEMAP_TTL']
+    return response.make_conditional(request)
+
+
+@blueprint.route('/sitemap.xml')
+def sitemap_xml():
+    return _sitemap_response('index', 'application/xml')
+
+
+@blueprint.route('/sitemaps/<int:chunk>.txt')
+def sitemap_chunk_txt(chunk):
+    return _sitemap_response(chunk, 'text/plain')
+
+
 @blueprint.route('/sitemap.txt')
 def sitemap_txt():
-    client = get_client()
-    uuids = client.get_all_dataset_uuids()
-    url_base = get_url_base_from_request()
-    return Response(
-        '\n'.join(
-            f'{url_base}/browse/dataset/{uuid}' for uuid in uuids
-        ),
-        mimetype='text/plain')
+    # Superseded by sitemap.xml, but may still be registered with search engines.
+    return _sitemap_response('all', 'text/plain')
 
 
 @blueprint.route('/robots.txt')
@@ -177,6 +320,6 @@ def robots_txt():
 # Allowed host: {allowed_hostname}
 User-agent: *
 Disallow: {disallow}
-Sitemap: {get_url_base_from_request()}/sitemap.txt
+Sitemap: {get_url_base_from_request()}/sitemap.xml
 ''',
         mimetype='text/plain')
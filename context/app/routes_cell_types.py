@@ -1,26 +1,22 @@
-from flask import json, current_app, render_template
-from requests import post
+from flask import json, current_app, g, render_template, session
 from datetime import datetime
-from asyncio import gather, to_thread
+from asyncio import gather, Semaphore
 
+from .caching import get_cache
+from .executor import run_upstream
+from .portal_client import _visibility_class
 from .routes_file_based import _get_organ_list
-from .routes_cells import _get_client
+from .routes_cells import _get_client, _get_cell_type_vocabulary
 
 from .utils import make_blueprint, get_client, get_default_flask_data
 
 
-cells_client_env = 'dev'
-cells_url = f'https://cells.{cells_client_env}.hubmapconsortium.org/api'
-celltype_url = f'{cells_url}/celltype/'
-celltype_eval_url = f'{cells_url}/celltypeevaluation/'
-
-
 # NOTE: This file makes heavy use of async/await and asyncio.gather
 # The purpose of this is to make independent API calls in parallel,
 # since these requests are I/O bound and can thus be made concurrently
 # to improve performance and reduce latency.
-# The `to_thread` function is used to run synchronous code in a
-# separate thread, and `gather` is used to wait for these threaded
+# The `run_upstream` function is used to run synchronous code on the
+# worker's shared thread pool, and `gather` is used to wait for these threaded
 # operations to complete.
 
 
@@ -48,24 +44,37 @@ def genes_detail_view(gene_symbol):
     )
 
 
-# Fetches list of all cell types
+# Lists all cell types: This is the cell type vocabulary used by the molecular data queries,
+# so it is shared across workers, and refreshed in the background.
 @blueprint.route('/cell-types/list.json')
 def cell_types_list():
-    celltype_token_post = post(celltype_url, {}).json()
-    celltype_token = celltype_token_post['results'][0]['query_handle']
-    celltype_list = post(celltype_eval_url, {
-        'key': celltype_token,
-        'set_type': 'cell_type',
-        'limit': 500}).json()['results']
-    celltype_list = list(map(lambda x: x['grouping_name'], celltype_list))
-    return celltype_list
+    return list(_get_cell_type_vocabulary(current_app).cell_label_ids)
 
 
 # Handles detail page lookups for cell types, proteins, and genes
 @blueprint.route('/x-modality/<feature>/<feature_id>.json', methods=['GET'])
 async def get_feature_details(feature, feature_id):
-    client = _get_client(current_app)
     feature = _feature_name(feature)
+    # The samples depend on what the user can see.
+    key = (feature, feature_id, _visibility_class(session.get('groups_token')))
+    cache = get_cache('x_modality')
+    details = cache.get(key)
+    if details is None:
+        details = await _get_feature_details(feature, feature_id)
+        # Sub-calls fall back to empty results if they fail: Do not keep those for an hour.
+        if not g.get('x_modality_failed'):
+            cache.set(key, details)
+    return details
+
+
+def _log_failure(message):
+    # Calls on the upstream pool share the request's app context, and so `g`.
+    current_app.logger.info(message)
+    g.x_modality_failed = True
+
+
+async def _get_feature_details(feature, feature_id):
+    client = _get_client(current_app)
     if feature == 'cell_type':
         datasets, organs = await gather(
             _get_datasets_for_cell_type(client, feature_id),
@@ -104,7 +113,7 @@ async def _get_datasets_for_cell_type(client, feature_id):
         datasets = client.select_datasets(
             where="cell_type", has=[feature_id])
         return _unwrap_result_set(datasets)
-    return await to_thread(fetch_and_unwrap_datasets)
+    return await run_upstream(fetch_and_unwrap_datasets)
 
 
 # Fetches a list of datasets containing a given gene
@@ -115,12 +124,12 @@ async def _get_datasets_for_gene(client, gene_symbol):
                 where="gene", has=[f'{gene_symbol} > 1'],
                 genomic_modality=modality, min_cell_percentage=1.0)
         except Exception as err:
-            current_app.logger.info(
+            _log_failure(
                 f'Datasets not found for gene {gene_symbol} with {modality} modality. {err}')
             return []
     rna_datasets, atac_datasets = await gather(
-        to_thread(get_datasets_for_modality, 'rna'),
-        to_thread(get_datasets_for_modality, 'atac'))
+        run_upstream(get_datasets_for_modality, 'rna'),
+        run_upstream(get_datasets_for_modality, 'atac'))
     datasets = _combine_results(rna_datasets, atac_datasets)
     datasets = _unwrap_result_set(datasets)
     datasets = list(map(lambda x: x['uuid'], datasets))
@@ -137,7 +146,7 @@ async def _get_organs_for_cell_type(client, cell_type):
             organs = list(map(lambda x: x['grouping_name'], organs))
             return organs
         except Exception as err:
-            current_app.logger.info(
+            _log_failure(
                 f'Organs not found for cell type {cell_type}. {err}')
             return None
 
@@ -148,24 +157,31 @@ async def _get_organs_for_cell_type(client, cell_type):
                 where="cell_type", has=[cell_type])
             return cells_of_type
         except Exception as err:
-            current_app.logger.info(
+            _log_failure(
                 f'Cells not found for cell type {cell_type}. {err}')
             return None
 
     # Make above calls in parallel
     organs, cells_of_type = await gather(
-        to_thread(_get_organs_for_cell_type),
-        to_thread(_get_cells_of_type))
+        run_upstream(_get_organs_for_cell_type),
+        run_upstream(_get_cells_of_type))
 
     if not cells_of_type or not organs:
         return []
 
     # Get cell counts for each organ
-    def get_cell_counts(organ):
-        organ_counts = client.select_cells(
+    total_cells_cache = get_cache('organ_cell_counts')
+
+    def select_organ_cells(organ):
+        organ_cells = client.select_cells(
             where="organ", has=[organ])
-        total_cells = len(organ_counts)
-        feature_cells = organ_counts & cells_of_type
+        return organ_cells, len(organ_cells)
+
+    def get_cell_counts(organ):
+        # The organ's cells, and their total, are the same for every cell type.
+        organ_cells, total_cells = total_cells_cache.get_or_set(
+            organ, lambda: select_organ_cells(organ))
+        feature_cells = organ_cells & cells_of_type
         feature_cells = len(feature_cells)
         return {
             'organ': organ,
@@ -174,8 +190,15 @@ async def _get_organs_for_cell_type(client, cell_type):
             'other_cells': total_cells - feature_cells
         }
 
+    # Limit how many organs are counted at once, so one page does not swamp the cells API.
+    semaphore = Semaphore(current_app.config['X_MODALITY_CONCURRENCY'])
+
+    async def get_cell_counts_when_ready(organ):
+        async with semaphore:
+            return await run_upstream(get_cell_counts, organ)
+
     organs = await gather(
-        *[to_thread(get_cell_counts, organ) for organ in organs]
+        *[get_cell_counts_when_ready(organ) for organ in organs]
     )
     return organs
 
@@ -190,12 +213,12 @@ async def _get_organs_for_gene(client, gene_symbol):
                 genomic_modality=modality,
                 p_value=0.05)
         except Exception as err:
-            current_app.logger.info(
+            _log_failure(
                 f'Organs not found for gene {gene_symbol} with {modality} modality. {err}')
             return []
     organs_with_gene_atac, organs_with_gene_rna = await gather(
-        to_thread(request_organs_with_modality, 'atac'),
-        to_thread(request_organs_with_modality, 'rna'))
+        run_upstream(request_organs_with_modality, 'atac'),
+        run_upstream(request_organs_with_modality, 'rna'))
     if not organs_with_gene_atac and not organs_with_gene_rna:
         return []
     # Combine results from both modalities
@@ -241,9 +264,9 @@ async def _get_cell_types_for_gene(client, gene_symbol, datasets):
                 return []
         # Request sets of cells in parallel
         cells_in_datasets, rna_cells, atac_cells = await gather(
-            to_thread(get_cells_for_datasets),
-            to_thread(request_cells_with_modality, 'rna'),
-            to_thread(request_cells_with_modality, 'atac'))
+            run_upstream(get_cells_for_datasets),
+            run_upstream(request_cells_with_modality, 'rna'),
+            run_upstream(request_cells_with_modality, 'atac'))
         print(f"{datetime.now()} Cells with {gene_symbol} in current datasets subset: ",
               len(cells_in_datasets))
         print(f"{datetime.now()} RNA Cells {gene_symbol} > {minimum_expression_value}: ",
@@ -282,7 +305,7 @@ async def _get_cell_types_for_gene(client, gene_symbol, datasets):
 
         # Extract cell info in parallel
         await gather(
-            *[to_thread(extract_cell_info, i, genes_to_fetch)
+            *[run_upstream(extract_cell_info, i, genes_to_fetch)
               for i in range(0, count, genes_to_fetch)]
         )
 
@@ -365,5 +388,5 @@ def _get_samples_for_datasets(datasets):
                     } for sample in samples]
         return samples
     except Exception as err:
-        current_app.logger.info(f'Samples not found for {datasets}. {err}')
+        _log_failure(f'Samples not found for {datasets}. {err}')
         return []
@@ -1,16 +1,21 @@
-from itertools import islice, groupby
+import json
 from posixpath import dirname
+from os.path import join
 import time
 
-from flask import render_template, current_app, request
+from flask import (
+    render_template, current_app, request, has_request_context, abort,
+    Response, stream_with_context)
 # from asyncio import gather, to_thread
 
-from hubmap_api_py_client import Client
 from hubmap_api_py_client.errors import ClientError
 
+from .autocomplete import SubstringIndex
+from .caching import get_refreshing_value, get_result_cache
 from .utils import get_default_flask_data, make_blueprint
-
-from operator import itemgetter
+from .http_pool import get_session
+from .portal_client import CellsClient
+from .snapshots import SnapshotStore
 
 from collections import defaultdict
 
@@ -43,7 +48,7 @@ def biomarkers_ui():
 
 
 def _get_client(app):
-    return Client(app.config['XMODALITY_ENDPOINT'] + '/api/')
+    return CellsClient(app.config['XMODALITY_ENDPOINT'] + '/api/', session=get_session(app))
 
 
 def timeit(f):
@@ -52,7 +57,11 @@ def timeit(f):
         str_args = [str(arg) for arg in args]
         trunc_args = [arg[:limit] + ('...' if len(arg) > limit else '') for arg in str_args]
         trunk_kwargs = [f'{k}=...' for k in kwargs]
-        url = f'{request.path}?{request.query_string.decode("UTF-8")}'
+        # Warm-up runs outside of any request.
+        url = (
+            f'{request.path}?{request.query_string.decode("UTF-8")}'
+            if has_request_context() else '(warm-up)'
+        )
         func = f'{f.__name__}({", ".join(trunc_args + trunk_kwargs)})'
 
         current_app.logger.info(' | '.join(['START', url, func]))
@@ -71,27 +80,67 @@ def timeit(f):
 def preload_cells_api(app):
     # Preload the gene symbols, protein IDs, and cell IDs on server startup
     # so that they are immediately available when the user starts typing.
+    # Run by the warm-up thread, after each worker starts: See main.py.
 
-    funcs = [_get_gene_symbols, _get_protein_ids, _get_cell_ids]
+    funcs = [_get_gene_symbol_index, _get_protein_id_index, _get_cell_type_vocabulary]
 
     for func in funcs:
         func(app)
 
 
+def _get_vocabulary(app, name, fetch, build):
+    # Fetch the list of strings from the snapshot shared by the workers on this host,
+    # or if it is missing or stale, from the API, then build the in-memory structures.
+    # After the TTL, the old value is served while a new one is loaded.
+    def load():
+        with app.app_context():
+            store = _get_snapshot_store(app)
+            strings = store.load(name, lambda: fetch(app)) if store else tuple(fetch(app))
+            return build(strings)
+    return get_refreshing_value(
+        f'cells_{name}', load, ttl=app.config['CELLS_VOCABULARY_TTL']).get()
+
+
+def _get_snapshot_store(app):
+    dir_path = app.config['VOCABULARY_SNAPSHOT_DIR']
+    if dir_path is None:
+        return None
+    # Not under the shared temporary directory, where other users could plant snapshots.
+    return SnapshotStore(
+        join(app.instance_path, dir_path), source=app.config['XMODALITY_ENDPOINT'],
+        ttl=app.config['CELLS_VOCABULARY_TTL'])
+
+
+def _iter_results(results_set, page_size=10000):
+    # Page through the query handle until it is exhausted.
+    # (The client's own iterator removes each item from the front of a list,
+    # which is slow for long lists.)
+    results_list = results_set.get_list()
+    offset = 0
+    while True:
+        page = results_list[offset:offset + page_size]
+        yield from page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+
 @timeit
-@cache
-def _get_gene_symbols(app):
+def _fetch_gene_symbols(app):
     client = _get_client(app)
-    gene_symbols = tuple([gene["gene_symbol"] for gene in client.select_genes().get_list()])
-    return gene_symbols
+    return [gene["gene_symbol"] for gene in _iter_results(client.select_genes())]
 
 
 @timeit
-@cache
-def _get_protein_ids(app):
+def _fetch_protein_ids(app):
+    client = _get_client(app)
+    return [protein["protein_id"] for protein in _iter_results(client.select_proteins())]
+
+
+@timeit
+def _fetch_cell_label_ids(app):
     client = _get_client(app)
-    protein_ids = tuple([protein["protein_id"] for protein in client.select_proteins().get_list()])
-    return protein_ids
+    return sorted({cell["grouping_name"] for cell in _iter_results(client.select_celltypes())})
 
 
 @cache
@@ -106,55 +155,127 @@ def _get_all_labels():
     return all_labels
 
 
-@timeit
-@cache
-def _get_cell_ids(app):
-    client = _get_client(app)
-    cell_label_ids = [cell["grouping_name"] for cell in client.select_celltypes().get_list()]
-    all_labels = _get_all_labels()
-    # Filter labels to only include the ones that are in the cell_label_ids
-    all_labels = tuple([label for label in all_labels if label['CL_ID'] in cell_label_ids])
-    # Add the CL_ID to the label
-    for label in all_labels:
-        label['Lookup_Label'] = f'{label["Label"]} ({label["CL_ID"]})'
+def _make_cell_ids(cell_label_ids, all_labels):
+    '''
+    >>> all_labels = [{'CL_ID': 'CL:1', 'Label': 'T cell'}, {'CL_ID': 'CL:1', 'Label': 'T'},
+    ...               {'CL_ID': 'CL:2', 'Label': 'B'}]
+    >>> _make_cell_ids({'CL:1'}, all_labels)
+    [{'CL_ID': 'CL:1', 'Label': 'T', 'Lookup_Label': 'T (CL:1)'}]
+    '''
+    # Filter labels to only include the ones that are in the cell_label_ids,
+    # and add the CL_ID to the label. Copy, so the shared all_labels are not modified.
+    all_labels = [
+        {**label, 'Lookup_Label': f'{label["Label"]} ({label["CL_ID"]})'}
+        for label in all_labels if label['CL_ID'] in cell_label_ids]
     # Remove any duplicate labels for the same CLID
     # while keeping  the one with the shortest name
     # since the input for the cells API only uses the CLID, having these variants
     # as separate options is unnecessary and confusing to the user
-    labels_to_remove = []
+    shortest_by_clid = {}
     for label in all_labels:
-        duplicate_clids = [l for l in all_labels if l['CL_ID']
-                           == label['CL_ID']]
-        if len(duplicate_clids) > 1:
-            duplicate_clids = sorted(
-                duplicate_clids, key=lambda x: len(x['Label']))
-            for l in duplicate_clids[1:]:
-                # Azimuth ID's are unique, so we can use them to remove the duplicates
-                labels_to_remove.append(l["A_ID"])
-    all_labels = [label for label in all_labels if label["A_ID"] not in labels_to_remove]
+        shortest = shortest_by_clid.get(label['CL_ID'])
+        if shortest is None or len(label['Label']) < len(shortest['Label']):
+            shortest_by_clid[label['CL_ID']] = label
+    return [label for label in all_labels if shortest_by_clid[label['CL_ID']] is label]
 
-    return all_labels
+
+@dataclass
+class CellTypeLookups:
+    label_by_clid: dict
+    clid_by_label: dict
+    names_by_clid: dict
+
+
+def _make_cell_type_lookups(cell_ids, all_labels):
+    '''
+    >>> cell_ids = [{'CL_ID': 'CL:1', 'Label': 'T', 'Lookup_Label': 'T (CL:1)'}]
+    >>> all_labels = [{'CL_ID': 'CL:1', 'Label': 'T'}, {'CL_ID': 'CL:1', 'Label': 'T cell'},
+    ...               {'CL_ID': 'CL:1', 'Label': 'T'}]
+    >>> lookups = _make_cell_type_lookups(cell_ids, all_labels)
+    >>> lookups.label_by_clid['CL:1']
+    'T'
+    >>> lookups.clid_by_label['T (CL:1)']
+    'CL:1'
+    >>> lookups.names_by_clid['CL:1']
+    ('T', 'T cell')
+    '''
+    label_by_clid = {}
+    clid_by_label = {}
+    for cell in cell_ids:
+        label_by_clid.setdefault(cell['CL_ID'], cell['Label'])
+        clid_by_label.setdefault(cell['Label'], cell['CL_ID'])
+        clid_by_label.setdefault(cell['Lookup_Label'], cell['CL_ID'])
+    names_by_clid = defaultdict(set)
+    for label in all_labels:
+        names_by_clid[label['CL_ID']].add(label['Label'])
+    return CellTypeLookups(
+        label_by_clid=label_by_clid,
+        clid_by_label=clid_by_label,
+        # Deduplicate any exact matches and sort alphabetically
+        names_by_clid={clid: tuple(sorted(names)) for clid, names in names_by_clid.items()})
+
+
+@dataclass
+class CellTypeVocabulary:
+    cell_label_ids: tuple
+    cell_ids: list
+    index: SubstringIndex
+    lookups: CellTypeLookups
+
+
+def _make_cell_type_vocabulary(cell_label_ids):
+    cell_ids = _make_cell_ids(set(cell_label_ids), _get_all_labels())
+    return CellTypeVocabulary(
+        cell_label_ids=tuple(cell_label_ids),
+        cell_ids=cell_ids,
+        index=SubstringIndex([cell['Lookup_Label'] for cell in cell_ids]),
+        lookups=_make_cell_type_lookups(cell_ids, _get_all_labels()))
+
+
+def _get_gene_symbol_index(app):
+    return _get_vocabulary(app, 'gene_symbols', _fetch_gene_symbols, SubstringIndex)
+
+
+def _get_protein_id_index(app):
+    return _get_vocabulary(app, 'protein_ids', _fetch_protein_ids, SubstringIndex)
+
+
+def _get_cell_type_vocabulary(app):
+    return _get_vocabulary(
+        app, 'cell_label_ids', _fetch_cell_label_ids, _make_cell_type_vocabulary)
+
+
+def _get_gene_symbols(app):
+    return _get_gene_symbol_index(app).strings
+
+
+def _get_protein_ids(app):
+    return _get_protein_id_index(app).strings
+
+
+def _get_cell_ids(app):
+    return _get_cell_type_vocabulary(app).cell_ids
+
+
+def _get_cell_type_index(app):
+    return _get_cell_type_vocabulary(app).index
+
+
+def _get_cell_type_lookups(app):
+    return _get_cell_type_vocabulary(app).lookups
 
 
 @timeit
-def _first_n_matches(strings, substring, n):
+def _first_n_matches(index, substring, n):
     '''
-    >>> strings = [f'fake{n}' for n in range(200)]
-    >>> first_n = _first_n_matches(strings, 'e1', 10)
+    >>> index = SubstringIndex([f'fake{n}' for n in range(200)])
+    >>> first_n = _first_n_matches(index, 'e1', 10)
     >>> first_n[0]
     {'full': 'fake1', 'pre': 'fak', 'match': 'e1', 'post': ''}
     >>> first_n[-1]
     {'full': 'fake18', 'pre': 'fak', 'match': 'e1', 'post': '8'}
     '''
-    substring_lower = substring.lower()
-    first_n = list(islice((s for s in strings if substring_lower in s.lower()), n))
-    offsets = [s.lower().find(substring_lower) for s in first_n]
-    return [{
-        'full': s,
-        'pre': s[:offset],
-        'match': s[offset:offset + len(substring)],
-        'post': s[offset + len(substring):]
-    } for s, offset in zip(first_n, offsets)]
+    return index.search(substring, n)
 
 
 @dataclass
@@ -181,14 +302,19 @@ def _get_cluster_name_and_number(cluster_str):
 
 
 @timeit
-def _get_cluster_cells(cells=None, cell_variable_name=None, min_expression=None):
+def _get_matched_cell_counts_per_cluster(cells=None, cell_variable_name=None, min_expression=None):
     '''
-    >>> cells = _get_cluster_cells(cells=[
+    For each cluster a cell belongs to, count whether it meets the minimum expression.
+    This is a single pass over the cells, with counts kept in lists indexed by cluster:
+    Only the distinct clusters are parsed, sorted, and turned into dicts.
+
+    >>> clusters = _get_matched_cell_counts_per_cluster(cells=[
     ...         {
     ...             "clusters": [
     ...                 "cluster-method-a-1",
     ...                 "cluster-method-b-1"
     ...             ],
+    ...             "modality": "Z",
     ...             "values": {
     ...                 "VIM": 21.0
     ...             }
@@ -198,6 +324,7 @@ def _get_cluster_cells(cells=None, cell_variable_name=None, min_expression=None)
     ...                 "cluster-method-a-1",
     ...                 "cluster-method-b-2"
     ...             ],
+    ...             "modality": "Z",
     ...             "values": {
     ...                 "VIM": 12.0
     ...             }
@@ -207,87 +334,13 @@ def _get_cluster_cells(cells=None, cell_variable_name=None, min_expression=None)
     ...                 "cluster-method-a-1",
     ...                 "cluster-method-b-1"
     ...             ],
+    ...             "modality": "Z",
     ...             "values": {
     ...                 "VIM": 7.0
     ...             }
     ...         }], cell_variable_name='VIM', min_expression=10)
     >>> import pprint
-    >>> pprint.pprint(cells)
-    [{'cluster_name': 'cluster-method-a',
-      'cluster_number': '1',
-      'meets_minimum_expression': True,
-      'modality': None},
-     {'cluster_name': 'cluster-method-b',
-      'cluster_number': '1',
-      'meets_minimum_expression': True,
-      'modality': None},
-     {'cluster_name': 'cluster-method-a',
-      'cluster_number': '1',
-      'meets_minimum_expression': True,
-      'modality': None},
-     {'cluster_name': 'cluster-method-b',
-      'cluster_number': '2',
-      'meets_minimum_expression': True,
-      'modality': None},
-     {'cluster_name': 'cluster-method-a',
-      'cluster_number': '1',
-      'meets_minimum_expression': False,
-      'modality': None},
-     {'cluster_name': 'cluster-method-b',
-      'cluster_number': '1',
-      'meets_minimum_expression': False,
-      'modality': None}]
-    '''
-    cluster_cells = []
-    for cell in cells:
-        for cluster in cell['clusters']:
-            cluster_name, cluster_number = _get_cluster_name_and_number(cluster)
-            cluster_cell = {'cluster_name': cluster_name,
-                            'cluster_number': cluster_number,
-                            'meets_minimum_expression':
-                            cell['values'][cell_variable_name] >= min_expression,
-                            'modality': cell.get('modality')}
-            cluster_cells.append(cluster_cell)
-    return cluster_cells
-
-
-@timeit
-def _get_matched_cell_counts_per_cluster(cells):
-    '''
-    >>> clusters = _get_matched_cell_counts_per_cluster(cells=[
-    ...         {
-    ...             'modality': 'Z',
-    ...             'cluster_name': 'cluster-method-a',
-    ...             'cluster_number': '1', 'meets_minimum_expression': True
-    ...         },
-    ...         {
-    ...             'modality': 'Z',
-    ...             'cluster_name': 'cluster-method-b',
-    ...             'cluster_number': '1', 'meets_minimum_expression': True
-    ...         },
-    ...         {
-    ...             'modality': 'Z',
-    ...             'cluster_name': 'cluster-method-a',
-    ...             'cluster_number': '1', 'meets_minimum_expression': True
-    ...         },
-    ...         {
-    ...             'modality': 'Z',
-    ...             'cluster_name': 'cluster-method-b',
-    ...             'cluster_number': '2', 'meets_minimum_expression': True
-    ...         },
-    ...         {
-    ...             'modality': 'Z',
-    ...             'cluster_name': 'cluster-method-a',
-    ...             'cluster_number': '1', 'meets_minimum_expression': False
-    ...         },
-    ...         {
-    ...             'modality': 'Z',
-    ...             'cluster_name': 'cluster-method-b',
-    ...             'cluster_number': '1', 'meets_minimum_expression': False
-    ...         },
-    ...     ])
-    >>> import pprint
-    >>> pprint.pprint(dict(clusters))
+    >>> pprint.pprint(clusters)
     {'cluster-method-a': [{'cluster_name': 'cluster-method-a',
                            'cluster_number': '1',
                            'matched': 2,
@@ -304,52 +357,86 @@ def _get_matched_cell_counts_per_cluster(cells):
                            'modality': 'Z',
                            'unmatched': 0}]}
     '''
-    group_keys = ["cluster_name", "cluster_number", "modality"]
-    grouper = itemgetter(*group_keys)
-    clusters = defaultdict(lambda: [])
-    for key, grp in groupby(sorted(cells, key=grouper), grouper):
-        is_annotation = key[0] == ''
-        grp_list = list(grp)
-        # Re-format the annotation cluster set
-        if (is_annotation):
+    # Intern each (cluster, modality) as an index into the count lists.
+    cluster_ids = {}
+    totals = []
+    matches = []
+    for cell in cells:
+        meets_minimum_expression = cell['values'][cell_variable_name] >= min_expression
+        modality = cell.get('modality')
+        for cluster in cell['clusters']:
+            cluster_id = cluster_ids.get((cluster, modality))
+            if cluster_id is None:
+                cluster_id = cluster_ids[(cluster, modality)] = len(totals)
+                totals.append(0)
+                matches.append(0)
+            totals[cluster_id] += 1
+            if meets_minimum_expression:
+                matches[cluster_id] += 1
+
+    keyed_ids = sorted(
+        (
+            (*_get_cluster_name_and_number(cluster), modality or ''), modality, cluster_id
+        ) for (cluster, modality), cluster_id in cluster_ids.items()
+    )
+    # Annotation clusters have no method name, and are numbered by CLID:
+    # Re-format the annotation cluster set with the cell type labels.
+    annotation_labels = iter(translate_clids(
+        [key[1] for key, _, _ in keyed_ids if key[0] == '']))
+    clusters = {}
+    for (cluster_name, cluster_number, _), modality, cluster_id in keyed_ids:
+        if cluster_name == '':
             cluster_name = 'Annotation'
-            key = (cluster_name, translate_clid(key[1]), key[2])
-            grp_list = [{
-                'cluster_name': 'Annotation',
-                'cluster_number': translate_clid(item['cluster_number']),
-                'modality': item['modality'],
-                'meets_minimum_expression': item['meets_minimum_expression']
-            } for item in grp_list]
-        cluster = dict(zip(group_keys, key))
-        matched_count = [item['meets_minimum_expression'] for item in grp_list].count(True)
-        cluster.update({
-            'matched': matched_count,
-            'unmatched': len(grp_list) - matched_count
+            cluster_number = next(annotation_labels)
+        clusters.setdefault(cluster_name, []).append({
+            'cluster_name': cluster_name,
+            'cluster_number': cluster_number,
+            'modality': modality,
+            'matched': matches[cluster_id],
+            'unmatched': totals[cluster_id] - matches[cluster_id]
         })
-        clusters[cluster['cluster_name']].append(cluster)
     return clusters
 
 
+def _normalize_threshold(value):
+    '''
+    So that equivalent queries share a cache entry.
+
+    >>> _normalize_threshold('1'), _normalize_threshold(' 1.0 '), _normalize_threshold(None)
+    (1.0, 1.0, None)
+    '''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _cached_results(query, get_results):
+    # Popular datasets and genes are viewed repeatedly by different users,
+    # and these results do not depend on the user.
+    results, cache_status = get_result_cache('cells_results').get_or_set(query, get_results)
+    return {'results': results}, {'X-Cache': cache_status}
+
+
 @timeit
 @blueprint.route('/cells/genes-by-substring.json', methods=['POST'])
 def genes_by_substring():
     substring = request.args.get('substring')
-    return {'results': _first_n_matches(_get_gene_symbols(current_app), substring, 10)}
+    return {'results': _first_n_matches(_get_gene_symbol_index(current_app), substring, 10)}
 
 
 @timeit
 @blueprint.route('/cells/proteins-by-substring.json', methods=['POST'])
 def proteins_by_substring():
     substring = request.args.get('substring')
-    return {'results': _first_n_matches(_get_protein_ids(current_app), substring, 10)}
+    return {'results': _first_n_matches(_get_protein_id_index(current_app), substring, 10)}
 
 
 @timeit
 @blueprint.route('/cells/cell-types-by-substring.json', methods=['POST'])
 def cell_types_by_substring():
     substring = request.args.get('substring')
-    cell_types = _get_cell_ids(current_app)
-    results = _first_n_matches([cell['Lookup_Label'] for cell in cell_types], substring, 10)
+    results = _first_n_matches(_get_cell_type_index(current_app), substring, 10)
     return {'results': results}
 
 
@@ -408,14 +495,17 @@ def cell_percentages_for_datasets():
     gene_name = request.args.get('gene_name')
     min_gene_expression = request.args.get('min_gene_expression')
 
-    client = _get_client(current_app)
-
-    dataset_set = client.select_datasets(where='dataset', has=[uuids])
-    results = list(dataset_set.get_list(
-        values_included=[f'{gene_name} > {min_gene_expression}'])
-    )
+    def get_results():
+        client = _get_client(current_app)
+        dataset_set = client.select_datasets(where='dataset', has=[uuids])
+        return list(dataset_set.get_list(
+            values_included=[f'{gene_name} > {min_gene_expression}'])
+        )
 
-    return {'results': results}
+    return _cached_results(
+        ('cell-percentages', tuple(sorted(set(uuids))), gene_name,
+         _normalize_threshold(min_gene_expression)),
+        get_results)
 
 
 @timeit
@@ -424,17 +514,161 @@ def cell_expression_in_dataset():
     # For a single dataset we want to get the expression level of a given gene for all cells.
     # (In our discussion, we started by thinking about the set of matching cells,
     # and then showing expression levels for the two groups, but that’s not needed.)
+    #
+    # The response is streamed, a page of cells at a time. With "format=ndjson",
+    # there is one cell per line; With "format=columns", one page per line,
+    # with parallel arrays for each field, and for each gene under "values".
 
     uuid = request.args.get('uuid')
     cell_variable_names = request.args.getlist('cell_variable_names')
-
+    encoding = request.args.get('format', 'json')
+    if encoding not in _cell_encoders:
+        abort(400)
+
+    query = ('cell-expression', uuid, tuple(sorted(set(cell_variable_names))))
+    cache = get_result_cache('cells_results')
+    results, cache_status = cache.get(query)
+    if cache_status == 'MISS':
+        pages = _cache_pages(
+            cache, query,
+            _get_cell_expression_pages(uuid, cell_variable_names),
+            max_rows=current_app.config['CELLS_RESULTS_CACHE_MAX_ROWS'])
+    else:
+        pages = [results]
+
+    encode, mimetype = _cell_encoders[encoding]
+    errors = []
+    return Response(
+        stream_with_context(encode(_stop_on_error(pages, errors), errors)), mimetype=mimetype,
+        headers={'X-Cache': cache_status})
+
+
+def _get_cell_expression_pages(uuid, cell_variable_names):
     client = _get_client(current_app)
-
     cells = client.select_cells(where='dataset', has=[uuid])
-    # list() will call iterator behind the scenes.
-    results = list(cells.get_list(values_included=cell_variable_names))
-    results = [{**x, 'cell_type': translate_clid(x['cell_type'])} for x in results]
-    return {'results': results}
+    cells_list = cells.get_list(values_included=cell_variable_names)
+    total = len(cells_list)
+    page_size = current_app.config['CELLS_EXPRESSION_PAGE_SIZE']
+
+    def get_page(offset):
+        page = cells_list[offset:min(offset + page_size, total)]
+        cell_types = translate_clids([x['cell_type'] for x in page])
+        return [{**x, 'cell_type': cell_type} for x, cell_type in zip(page, cell_types)]
+
+    # Fetch the first page before streaming starts, so API errors are still reported normally,
+    # and a result of one page is complete before the response starts.
+    first_page = get_page(0)
+
+    def get_pages():
+        yield first_page
+        for offset in range(page_size, total, page_size):
+            yield get_page(offset)
+    return get_pages()
+
+
+def _stop_on_error(pages, errors):
+    '''
+    Once the response has started, its status can not change:
+    If a later page fails, stop, and add a message to `errors` for the encoder to send.
+
+    >>> def pages():
+    ...     yield [1]
+    ...     raise Exception('Cells API down')
+    >>> from flask import Flask
+    >>> errors = []
+    >>> with Flask(__name__).app_context():
+    ...     list(_stop_on_error(pages(), errors))
+    [[1]]
+    >>> errors
+    ['Cells API request failed after streaming started: Cells API down']
+    '''
+    try:
+        yield from pages
+    except Exception as e:
+        current_app.logger.exception('Cells API request failed after streaming started')
+        errors.append(f'Cells API request failed after streaming started: {e}')
+
+
+def _cache_pages(cache, query, pages, max_rows):
+    # Pass the pages through, and cache them all at the end, unless there are too many.
+    collected = []
+    for page in pages:
+        if collected is not None:
+            collected.extend(page)
+            if len(collected) > max_rows:
+                collected = None
+        yield page
+    if collected is not None:
+        cache.set(query, collected)
+
+
+def _encode_json(pages, errors=()):
+    '''
+    If the pages were cut short, the object also has an "error",
+    so the client can tell that the results are incomplete.
+
+    >>> ''.join(_encode_json([[{'a': 1}, {'a': 2}], [], [{'a': 3}]]))
+    '{"results": [{"a": 1}, {"a": 2}, {"a": 3}]}'
+    >>> ''.join(_encode_json([[{'a': 1}]], ['Failed']))
+    '{"results": [{"a": 1}], "error": "Failed"}'
+    '''
+    yield '{"results": ['
+    separator = ''
+    for page in pages:
+        if page:
+            yield separator + ', '.join(json.dumps(row) for row in page)
+            separator = ', '
+    yield ']' + ''.join(f', "error": {json.dumps(error)}' for error in errors[:1]) + '}'
+
+
+def _encode_ndjson(pages, errors=()):
+    '''
+    If the pages were cut short, the last line is an "error" object.
+
+    >>> ''.join(_encode_ndjson([[{'a': 1}], [{'a': 2}]]))
+    '{"a": 1}\\n{"a": 2}\\n'
+    >>> ''.join(_encode_ndjson([[{'a': 1}]], ['Failed']))
+    '{"a": 1}\\n{"error": "Failed"}\\n'
+    '''
+    for page in pages:
+        yield ''.join(json.dumps(row) + '\n' for row in page)
+    yield from _encode_error_lines(errors)
+
+
+def _encode_columns(pages, errors=()):
+    '''
+    If the pages were cut short, the last line is an "error" object.
+
+    >>> page = [{'cell_id': 'a', 'values': {'VIM': 1.0}}, {'cell_id': 'b', 'values': {'VIM': 2.0}}]
+    >>> print(''.join(_encode_columns([page])))
+    {"cell_id": ["a", "b"], "values": {"VIM": [1.0, 2.0]}}
+    <BLANKLINE>
+    '''
+    for page in pages:
+        if not page:
+            continue
+        columns = {}
+        for field in page[0]:
+            if field == 'values':
+                genes = page[0]['values']
+                columns[field] = {
+                    gene: [row['values'].get(gene) for row in page] for gene in genes}
+            else:
+                columns[field] = [row.get(field) for row in page]
+        yield json.dumps(columns) + '\n'
+    yield from _encode_error_lines(errors)
+
+
+def _encode_error_lines(errors):
+    for error in errors[:1]:
+        yield json.dumps({'error': error}) + '\n'
+
+
+_cell_encoders = {
+    'json': (_encode_json, 'application/json'),
+    'ndjson': (_encode_ndjson, 'application/x-ndjson'),
+    'columns': (_encode_columns, 'application/x-ndjson'),
+}
 
 
 @timeit
@@ -460,16 +694,18 @@ def cells_in_dataset_clusters():
     uuid = request.args.get('uuid')
     cell_variable_name = request.args.get('cell_variable_name')
     min_expression = request.args.get('min_expression')
-    client = _get_client(current_app)
 
-    cells = client.select_cells(where='dataset', has=[uuid])
-    cells_list = cells.get_list(values_included=cell_variable_name)
+    def get_results():
+        client = _get_client(current_app)
+        cells = client.select_cells(where='dataset', has=[uuid])
+        cells_list = cells.get_list(values_included=cell_variable_name)
+        return _get_matched_cell_counts_per_cluster(cells=cells_list,
+                                                    cell_variable_name=cell_variable_name,
+                                                    min_expression=float(min_expression))
 
-    return {'results':
-            _get_matched_cell_counts_per_cluster(
-                cells=_get_cluster_cells(cells=cells_list,
-                                         cell_variable_name=cell_variable_name,
-                                         min_expression=float(min_expression)))}
+    return _cached_results(
+        ('cluster-counts', uuid, cell_variable_name, _normalize_threshold(min_expression)),
+        get_results)
 
 
 @timeit
@@ -481,28 +717,21 @@ def get_all_names_for_cell_type():
     return {'results': _get_all_names_for_clid(clid)}
 
 
-@cache
 def translate_clid(clid):
     # Utility function to translate CLIDs to the Label
-    cell_ids = _get_cell_ids(current_app)
-    for cell in cell_ids:
-        if cell['CL_ID'] == clid:
-            return cell['Label']
+    return _get_cell_type_lookups(current_app).label_by_clid.get(clid)
+
+
+def translate_clids(clids):
+    # Translate a whole list of CLIDs at once
+    return list(map(_get_cell_type_lookups(current_app).label_by_clid.get, clids))
 
 
-@cache
 def translate_label(label):
     # Utility function to translate Labels to the CLID
-    cell_ids = _get_cell_ids(current_app)
-    for cell in cell_ids:
-        if cell['Label'] == label or cell['Lookup_Label'] == label:
-            return cell['CL_ID']
+    return _get_cell_type_lookups(current_app).clid_by_label.get(label)
 
 
-@cache
 def _get_all_names_for_clid(clid):
     # Utility function to get all the unique cell names for a given CLID
-    cell_ids = _get_all_labels()
-    labels = [cell['Label'] for cell in cell_ids if cell['CL_ID'] == clid]
-    # Deduplicate any exact matches and sort alphabetically
-    return tuple(sorted(list(set(labels))))
+    return _get_cell_type_lookups(current_app).names_by_clid.get(clid, ())
@@ -1,13 +1,11 @@
 from os.path import dirname
-from pathlib import Path
 
-from yaml import safe_load
 from flask import render_template, redirect, url_for, request
 from werkzeug.utils import secure_filename
 
 import frontmatter
 
-from .utils import get_default_flask_data, get_organ_name_mapping, make_blueprint, get_organs
+from .utils import get_default_flask_data, get_organ_registry, make_blueprint, get_organs
 
 
 blueprint = make_blueprint(__name__)
@@ -53,10 +51,10 @@ def organ_index_view():
     )
 
 
-def redirect_to_organ_from_search(name, organs):
-    for k, v in organs.items():
-        if name in v.get('search'):
-            return redirect(url_for('routes_file_based.organ_details_view', name=k))
+def redirect_to_organ_from_search(name):
+    organ_key = get_organ_registry().find_key_by_search_term(name)
+    if organ_key is not None:
+        return redirect(url_for('routes_file_based.organ_details_view', name=organ_key))
     # If organ is not found, redirect to the organ index page with a message.
     return redirect(url_for('routes_file_based.organ_index_view', redirected_from=name), code=308)
 
@@ -65,7 +63,7 @@ def redirect_to_organ_from_search(name, organs):
 def organ_details_view(name):
     organ = get_organ_details(name)
     if (organ.keys().__len__() == 0):
-        return redirect_to_organ_from_search(name, get_organs())
+        return redirect_to_organ_from_search(name)
     flask_data = {
         **get_default_flask_data(),
         'organ': organ
@@ -79,18 +77,7 @@ def organ_details_view(name):
 
 @blueprint.route('/organ/<name>.json')
 def get_organ_details(name):
-    organs = get_organs()
-    organ_names = get_organ_name_mapping()
-    # Remove all spaces, underscores, and any text in parentheses
-    normalized_name = name.lower().strip()
-    normalized_name = normalized_name.split('(')[0].strip().replace(
-        ' ', '-').replace('_', '-')
-    safe_organ_name = organ_names.get(normalized_name)
-    if safe_organ_name not in organs:
-        return {}
-    filename = Path(dirname(__file__)) / 'organ' / f'{secure_filename(safe_organ_name)}.yaml'
-    organ = safe_load(filename.read_text())
-    return organ
+    return get_organ_registry().find(name) or {}
 
 
 @blueprint.route('/organs.json', methods=['POST'])
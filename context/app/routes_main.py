@@ -28,6 +28,20 @@ def service_status():
     )
 
 
+@blueprint.route('/health.json')
+def health():
+    # Always 200 if the app is up; "ready" is false until background warm-up is done.
+    warmup = current_app.extensions.get('warmup')
+    status = warmup.status() if warmup else {'ready': True, 'tasks': {}}
+    caches = current_app.extensions.get('portal_caches', {})
+    pid_executor = current_app.extensions.get('upstream_executor')
+    return {
+        **status,
+        'caches': {name: cache.stats() for name, cache in caches.items()},
+        'executor': pid_executor[1].stats() if pid_executor else None,
+    }
+
+
 @blueprint.route('/ccf-eui')
 def ccf_eui():
     return render_template(
@@ -1,28 +1,44 @@
 import re
+import json
+from dataclasses import dataclass
 from glob import glob
+from hashlib import sha256
 from os.path import dirname
 
-from flask import render_template, request, redirect
-from werkzeug.utils import secure_filename
+from flask import render_template, request, redirect, session, current_app
 
 from .utils import get_default_flask_data, make_blueprint
 
-# NOTE: A better approach might be to look again at the handful of libraries
-# that handle this, or to pre-render everything when flask starts.
+# NOTE: The set of documents is fixed when flask starts,
+# so everything is read once at import, and requests never touch the filesystem.
 
 blueprint = make_blueprint(__name__)
 
 
-def _secure_path(unsafe_path):
-    '''
-    >>> _secure_path('../../sneaky path.txt')
-    '//sneaky_path.txt'
+@dataclass(frozen=True)
+class MarkdownPage:
+    text: str
+    title: str
+    size: int
+    content_hash: str
+
 
-    >>> _secure_path('a/b/c/one_safe-path.txt')
-    'a/b/c/one_safe-path.txt'
+def _make_page(content_md):
     '''
-    # TODO: When we don't need to host docs, get rid of this.
-    return '/'.join(secure_filename(name) for name in unsafe_path.split('/'))
+    >>> page = _make_page('# Hello\\nWorld')
+    >>> page.title
+    'Hello'
+    >>> page.size
+    13
+    >>> page.content_hash[:8]
+    '527c46d1'
+    '''
+    encoded = content_md.encode()
+    return MarkdownPage(
+        text=content_md,
+        title=_title_from_md(content_md),
+        size=len(encoded),
+        content_hash=sha256(encoded).hexdigest())
 
 
 def _title_from_md(md):
@@ -38,30 +54,56 @@ def _title_from_md(md):
     return h1_matches[1].strip() if h1_matches else '(no title)'
 
 
+def _etag(page):
+    # The rendered page also depends on the session (login state in the header),
+    # configuration, and the static asset digests, so those are folded in too.
+    flask_data = get_default_flask_data()
+    static_digest = current_app.extensions.get('flask_static_digest')
+    context = json.dumps(
+        [flask_data, dict(session), static_digest.manifest if static_digest else None],
+        sort_keys=True, default=str)
+    return sha256(f'{page.content_hash}:{context}'.encode()).hexdigest()
+
+
 def markdown_view():
-    filename = f'{dirname(__file__)}/markdown/{_secure_path(request.path)}.md'
-    with open(filename) as md_file:
-        content_md = md_file.read()
-    title = _title_from_md(content_md)
-    return render_template(
-        'base-pages/react-content.html',
-        flask_data={
-            **get_default_flask_data(),
-            'markdown': content_md
-        },
-        title=title
-    )
+    page = _pages[request.url_rule.rule]
+    etag = _etag(page)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.make_response(render_template(
+            'base-pages/react-content.html',
+            flask_data={
+                **get_default_flask_data(),
+                'markdown': page.text
+            },
+            title=page.title
+        ))
+    response.set_etag(etag)
+    # Varies with the session cookie: Browsers may keep it, but should revalidate.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 
 def redirect_view():
-    filename = f'{dirname(__file__)}/markdown/{_secure_path(request.path)}.redirect'
-    with open(filename) as redirect_file:
-        target_url = redirect_file.read().strip()
-    return redirect(target_url)
+    return redirect(_redirects[request.url_rule.rule])
+
+
+def _read(filename):
+    with open(filename) as f:
+        return f.read()
+
 
+_pages = {}
+_redirects = {}
 
 app_dir = dirname(__file__)
 for (suffix, view_method) in [('.md', markdown_view), ('.redirect', redirect_view)]:
     for f in glob(app_dir + f'/markdown/**/*{suffix}', recursive=True):
         route = f.replace(app_dir + '/markdown', '').replace(suffix, '')
+        if suffix == '.md':
+            _pages[route] = _make_page(_read(f))
+        else:
+            _redirects[route] = _read(f).strip()
         blueprint.route(route)(view_method)
@@ -0,0 +1,96 @@
+import gzip
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from xml.sax.saxutils import escape
+
+
+class Sitemap(object):
+    '''
+    Dataset URLs for crawlers, split into chunks under the 50k URL limit,
+    with a sitemap index listing the chunks. The files are rendered once per URL base,
+    and kept both plain and gzipped.
+
+    >>> sitemap = Sitemap(['a', 'b', 'c'], chunk_size=2,
+    ...                   generated=datetime(2020, 1, 1, tzinfo=timezone.utc))
+    >>> print(sitemap.get_file('https://example.com', 1).text)
+    https://example.com/browse/dataset/c
+    >>> index = sitemap.get_file('https://example.com', 'index').text
+    >>> index.count('<sitemap>')
+    2
+    >>> '<loc>https://example.com/sitemaps/1.txt</loc>' in index
+    True
+    >>> '<lastmod>2020-01-01T00:00:00+00:00</lastmod>' in index
+    True
+    >>> sitemap.get_file('https://example.com', 2) is None
+    True
+
+    The URL base comes from the request's Host header, so only the most recently used
+    few are kept, and any others are rendered again when needed:
+
+    >>> sitemap = Sitemap(['a'], max_url_bases=1)
+    >>> sitemap.get_file('https://a.example.com', 'all').text
+    'https://a.example.com/browse/dataset/a'
+    >>> sitemap.get_file('https://b.example.com', 'all').text
+    'https://b.example.com/browse/dataset/a'
+    >>> list(sitemap._files)
+    ['https://b.example.com']
+    '''
+
+    def __init__(self, uuids, chunk_size=50000, generated=None, max_url_bases=4):
+        self.uuids = tuple(uuids)
+        self.chunk_size = chunk_size
+        # HTTP dates are to the second.
+        self.generated = generated or datetime.now(timezone.utc).replace(microsecond=0)
+        self.max_url_bases = max_url_bases
+        # URL base -> name -> file, least recently used first.
+        self._files = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-len(self.uuids) // self.chunk_size))
+
+    def get_file(self, url_base, name):
+        '''
+        `name` is 'index', 'all' (for the legacy single file), or a chunk number.
+        Returns None if there is no such chunk.
+        '''
+        if isinstance(name, int) and not 0 <= name < self.chunk_count:
+            return None
+        with self._lock:
+            files = self._files.get(url_base)
+            if files is None:
+                files = self._files[url_base] = {}
+                while len(self._files) > self.max_url_bases:
+                    self._files.popitem(last=False)
+            self._files.move_to_end(url_base)
+            if name not in files:
+                files[name] = SitemapFile(self._render(url_base, name))
+            return files[name]
+
+    def _render(self, url_base, name):
+        if name == 'index':
+            lastmod = self.generated.isoformat()
+            return '\n'.join([
+                '<?xml version="1.0" encoding="UTF-8"?>',
+                '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+                *(
+                    f'<sitemap><loc>{escape(url_base)}/sitemaps/{n}.txt</loc>'
+                    f'<lastmod>{lastmod}</lastmod></sitemap>'
+                    for n in range(self.chunk_count)
+                ),
+                '</sitemapindex>'
+            ])
+        uuids = (
+            self.uuids if name == 'all'
+            else self.uuids[name * self.chunk_size:(name + 1) * self.chunk_size]
+        )
+        return '\n'.join(f'{url_base}/browse/dataset/{uuid}' for uuid in uuids)
+
+
+class SitemapFile(object):
+    def __init__(self, text):
+        self.text = text
+        self.body = text.encode('utf-8')
+        self.gzipped = gzip.compress(self.body)
@@ -0,0 +1,94 @@
+from fcntl import flock, LOCK_EX, LOCK_UN
+from hashlib import sha256
+from logging import getLogger
+from os import makedirs, replace
+from pathlib import Path
+from time import time
+
+
+_logger = getLogger(__name__)
+
+# Bump if the file layout changes: Old snapshots are then ignored.
+_FORMAT = 'portal-strings-1'
+
+
+class SnapshotStore(object):
+    '''
+    Lists of strings, saved to disk so that all the workers on a host share one download.
+    The first worker to need a list fetches it and writes it, holding a file lock,
+    while the others wait for it and then read it. A snapshot older than `ttl` seconds
+    is fetched again; If that fails, the stale snapshot is used.
+    Snapshots are versioned by `source` (ie, the upstream URL) and by file format.
+
+    >>> from tempfile import mkdtemp
+    >>> store = SnapshotStore(mkdtemp(), source='https://example.com', ttl=60)
+    >>> store.load('genes', lambda: ['CD4', 'VIM'])
+    ('CD4', 'VIM')
+    >>> store.load('genes', lambda: ['Not fetched, because the snapshot is fresh'])
+    ('CD4', 'VIM')
+    >>> store.ttl = -1
+    >>> def fails():
+    ...     raise Exception('Upstream down')
+    >>> store.load('genes', fails)
+    ('CD4', 'VIM')
+    '''
+
+    def __init__(self, dir_path, source, ttl=86400, timer=time):
+        self.dir_path = Path(dir_path)
+        self.version = f'{_FORMAT}-{sha256(source.encode()).hexdigest()[:8]}'
+        self.ttl = ttl
+        self._timer = timer
+
+    def _path(self, name):
+        return self.dir_path / f'{name}.{self.version}.txt'
+
+    def _read(self, path, fresh_only=False):
+        try:
+            if fresh_only and path.stat().st_mtime + self.ttl <= self._timer():
+                return None
+            header, *strings = path.read_text(encoding='utf-8').split('\n')
+        except FileNotFoundError:
+            return None
+        if header != f'{self.version} {len(strings)}':
+            # Truncated or foreign file.
+            return None
+        return tuple(strings)
+
+    def _write(self, path, strings):
+        if any('\n' in s for s in strings):
+            raise ValueError('Snapshot strings can not contain newlines')
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(
+            '\n'.join([f'{self.version} {len(strings)}', *strings]), encoding='utf-8')
+        # Atomic, so readers never see a partial file.
+        replace(tmp_path, path)
+
+    def load(self, name, fetch):
+        '''
+        Returns the strings saved under `name`, calling `fetch()` if there are none,
+        or they are stale.
+        '''
+        path = self._path(name)
+        strings = self._read(path, fresh_only=True)
+        if strings is not None:
+            return strings
+        makedirs(self.dir_path, exist_ok=True)
+        with open(self.dir_path / f'{name}.lock', 'a') as lock_file:
+            flock(lock_file, LOCK_EX)
+            try:
+                # Another worker may have written it while we waited.
+                strings = self._read(path, fresh_only=True)
+                if strings is not None:
+                    return strings
+                try:
+                    strings = tuple(fetch())
+                except Exception:
+                    strings = self._read(path)
+                    if strings is None:
+                        raise
+                    _logger.exception(f'Fetching "{name}" failed; Using the stale snapshot.')
+                    return strings
+                self._write(path, strings)
+                return strings
+            finally:
+                flock(lock_file, LOCK_UN)
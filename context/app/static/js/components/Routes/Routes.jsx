@@ -47,6 +47,7 @@ function Routes({ flaskData }) {
     errorCode,
     list_uuid,
     entities,
+    lineup_next,
     organs,
     organs_count,
     organ,
@@ -265,7 +266,7 @@ function Routes({ flaskData }) {
   if (urlPath.startsWith('/lineup/')) {
     return (
       <Route>
-        <LineUpPage entities={entities} />
+        <LineUpPage entities={entities} next={lineup_next} />
       </Route>
     );
   }
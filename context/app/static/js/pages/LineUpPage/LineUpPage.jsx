@@ -1,4 +1,4 @@
-import React, { useMemo } from 'react';
+import React, { useEffect, useMemo, useState } from 'react';
 import LineUp, {
   LineUpStringColumnDesc,
   LineUpNumberColumnDesc,
@@ -10,11 +10,49 @@ import Paper from '@mui/material/Paper';
 
 import SectionHeader from 'js/shared-styles/sections/SectionHeader';
 import { useMetadataFieldTypes } from 'js/hooks/useUBKG';
+import { fetcher } from 'js/helpers/swr';
 
-function LineUpPage({ entities }) {
+// The page only embeds the first page of entities: Fetch the rest, one page after another.
+function useAllEntities(firstPage, firstNext) {
+  const [entities, setEntities] = useState(firstPage);
+
+  useEffect(() => {
+    let cancelled = false;
+    async function fetchRemainingPages() {
+      let next = firstNext;
+      let allEntities = firstPage;
+      while (next && !cancelled) {
+        const params = new URLSearchParams(window.location.search);
+        params.set('after', next);
+        // eslint-disable-next-line no-await-in-loop
+        const page = await fetcher({ url: `${window.location.pathname}.json?${params.toString()}` });
+        allEntities = allEntities.concat(page.entities);
+        next = page.next;
+      }
+      if (!cancelled) {
+        setEntities(allEntities);
+      }
+    }
+    fetchRemainingPages();
+    return () => {
+      cancelled = true;
+    };
+  }, [firstPage, firstNext]);
+
+  return entities;
+}
+
+function LineUpPage({ entities: firstPage, next }) {
+  const entities = useAllEntities(firstPage, next);
   const { dataKeys, normalizedEntities } = useMemo(() => {
+    // Pages are not filled in on the server, so fill in any keys missing from some rows.
+    const allKeys = new Set(entities.flatMap((entity) => Object.keys(entity)));
+    const filledEntities = entities.map((entity) => ({
+      ...Object.fromEntries([...allKeys].map((key) => [key, ''])),
+      ...entity,
+    }));
     // Remove any `undefined` or `null` fields from the entities
-    const cleanEntities = entities.map((entity) =>
+    const cleanEntities = filledEntities.map((entity) =>
       Object.fromEntries(Object.entries(entity).filter(([, value]) => value !== null && value !== undefined)),
     );
     // Get keys of first row
@@ -1,3 +1,5 @@
+import gzip
+
 import pytest
 
 from .main import create_app
@@ -90,21 +92,35 @@ def tsv_assertions(response):
 
 
 def test_tsv_get(client, mocker):
-    mocker.patch('requests.post', side_effect=mock_es_post)
-    mocker.patch('requests.get', side_effect=mock_es_get)
+    mock_post = mocker.patch('requests.Session.post', side_effect=mock_es_post)
+    mocker.patch('requests.Session.get', side_effect=mock_es_get)
     response = client.get('/metadata/v0/donors.tsv')
     tsv_assertions(response)
+    # The columns are found without a second search.
+    assert mock_post.call_count == 1
+
+
+def test_tsv_missing_metadata_empty(client, mocker, mock_es_hits):
+    mock_es_hits([
+        {'uuid': 'A', 'hubmap_id': 'HBM-A', 'mapped_metadata': {'age_unit': ['eons']}},
+        {'uuid': 'B', 'hubmap_id': 'HBM-B', 'mapped_metadata': {'age_value': [42]}},
+    ])
+    mocker.patch('requests.Session.get', side_effect=mock_es_get)
+    lines = client.get('/metadata/v0/donors.tsv').get_data(as_text=True).split('\r\n')
+    assert lines[2].startswith('A\tHBM-A\teons\t\t')
+    assert lines[3].startswith('B\tHBM-B\t\t42\t')
+    assert 'N/A' not in ''.join(lines)
 
 
 def test_tsv_post(client, mocker):
-    mocker.patch('requests.post', side_effect=mock_es_post)
-    mocker.patch('requests.get', side_effect=mock_es_get)
+    mocker.patch('requests.Session.post', side_effect=mock_es_post)
+    mocker.patch('requests.Session.get', side_effect=mock_es_get)
     response = client.post('/metadata/v0/donors.tsv', json={'uuids': []})
     tsv_assertions(response)
 
 
 def test_unexpected_json_tsv_post(client, mocker):
-    mocker.patch('requests.post', side_effect=mock_es_post)
+    mocker.patch('requests.Session.post', side_effect=mock_es_post)
     response = client.post('/metadata/v0/donors.tsv', json={'unexpected': []})
     assert response.status == '200 OK'  # TODO: Should not be 200!
     # https://github.com/hubmapconsortium/portal-ui/issues/2348
@@ -113,9 +129,68 @@ def test_unexpected_json_tsv_post(client, mocker):
 
 
 def test_unexpected_args_tsv_post(client, mocker):
-    mocker.patch('requests.post', side_effect=mock_es_post)
+    mocker.patch('requests.Session.post', side_effect=mock_es_post)
     response = client.post('/metadata/v0/donors.tsv?hello=world')
     assert response.status == '200 OK'  # TODO: Should not be 200!
     # https://github.com/hubmapconsortium/portal-ui/issues/2348
     assert response.get_data(as_text=True).strip() \
         == '{"message":"POST only accepts a JSON body.","status":400}'
+
+
+def test_tsv_get_gzip(client, mocker):
+    mocker.patch('requests.Session.post', side_effect=mock_es_post)
+    mocker.patch('requests.Session.get', side_effect=mock_es_get)
+    response = client.get('/metadata/v0/donors.tsv', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data).decode('utf-8') == mock_tsv
+
+
+def test_lineup_json(client, mocker):
+    mock_post = mocker.patch('requests.Session.post', side_effect=mock_es_post)
+    response = client.get('/lineup/donors.json?size=10&after=ABC000&fields=age_value')
+    assert response.json['entities'][0]['uuid'] == 'ABC123'
+    assert response.json['next'] is None
+    query = mock_post.call_args.kwargs['json']
+    assert query['size'] == 10
+    assert query['search_after'] == ['ABC000']
+    assert 'mapped_metadata.age_value' in query['_source']['include']
+    assert 'created_timestamp' not in query['_source']['include']
+
+
+@pytest.mark.parametrize('size', ['0', '-5'])
+def test_lineup_json_size_at_least_one(client, mock_es_hits, size):
+    mock_post = mock_es_hits([])
+    response = client.get(f'/lineup/donors.json?size={size}')
+    assert response.status == '200 OK'
+    assert response.json == {'entities': [], 'next': None}
+    assert mock_post.call_args.kwargs['json']['size'] == 1
+
+
+mock_globus_groups = [{'name': 'HuBMAP', 'uuid': 'fake-uuid', 'description': 'Fake group'}]
+
+
+def mock_globus_groups_get(path, **kwargs):
+    class MockResponse():
+        def __init__(self):
+            self.status_code = 200
+            self.headers = {'ETag': '"fake-etag"'}
+
+        def json(self):
+            return mock_globus_groups
+
+        def raise_for_status(self):
+            pass
+    return MockResponse()
+
+
+def test_globus_groups_cached(client, mocker):
+    mock_get = mocker.patch('requests.Session.get', side_effect=mock_globus_groups_get)
+    for _ in range(2):
+        response = client.get('/api/globus-groups.json')
+        assert response.status == '200 OK'
+        assert response.json == mock_globus_groups
+        assert 'max-age=3600' in response.headers['Cache-Control']
+    assert mock_get.call_count == 1
+    etag = response.headers['ETag']
+    response = client.get('/api/globus-groups.json', headers={'If-None-Match': etag})
+    assert response.status == '304 NOT MODIFIED'
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from .main import create_app
+
+
+@pytest.fixture
+def client():
+    app = create_app(testing=True)
+    with app.test_client() as client:
+        yield client
+
+
+def cells_json(path, data=None, **kwargs):
+    if path.endswith('/count/'):
+        return {'results': [{'count': 2}]}
+    if path.endswith('evaluation/'):
+        return {'results': [{'grouping_name': 'Kidney', 'uuid': 'fake-uuid'}]}
+    return {'results': [{'query_handle': 'fake-handle'}]}
+
+
+def count_calls(mock_post):
+    return len([call for call in mock_post.call_args_list if call.args[0].endswith('/count/')])
+
+
+def count_organ_selects(mock_post):
+    return len([call for call in mock_post.call_args_list
+                if call.args[0].endswith('/cell/') and call.args[1]['input_type'] == 'organ'])
+
+
+def test_cell_type_details_cached(client, mocker, mock_upstream):
+    mock_post = mock_upstream(cells_json)
+    mocker.patch('app.routes_cell_types._get_samples_for_datasets', return_value=[])
+
+    response = client.get('/x-modality/cell-types/CL:1.json')
+    assert response.status == '200 OK'
+    assert json.loads(response.data)['organs'] == [{
+        'organ': 'Kidney', 'total_cells': 2, 'feature_cells': 2, 'other_cells': 0}]
+    calls = mock_post.call_count
+
+    # The whole response is cached:
+    assert client.get('/x-modality/cell-types/CL:1.json').data == response.data
+    assert mock_post.call_count == calls
+
+    # For another cell type, everything is counted again except the organ total,
+    # and the organ's cells are not selected again:
+    first_counts = count_calls(mock_post)
+    first_organ_selects = count_organ_selects(mock_post)
+    client.get('/x-modality/cell-types/CL:2.json')
+    second_counts = count_calls(mock_post) - first_counts
+    assert second_counts == first_counts - 1
+    assert count_organ_selects(mock_post) == first_organ_selects == 1
+
+    executor = client.get('/health.json').json['executor']
+    assert executor['completed'] > 0
+    assert executor['in_flight'] == 0
+
+
+def test_cell_type_details_not_cached_after_failure(client, mocker, mock_upstream):
+    def organs_failure_json(path, data=None, **kwargs):
+        if path.endswith('/organ/'):
+            raise Exception('cells API down')
+        return cells_json(path, data, **kwargs)
+    mock_upstream(organs_failure_json)
+    mocker.patch('app.routes_cell_types._get_samples_for_datasets', return_value=[])
+
+    response = client.get('/x-modality/cell-types/CL:1.json')
+    assert response.status == '200 OK'
+    assert json.loads(response.data)['organs'] == []
+
+    mock_post = mock_upstream(cells_json)
+    response = client.get('/x-modality/cell-types/CL:1.json')
+    assert mock_post.call_count > 0
+    assert json.loads(response.data)['organs'][0]['organ'] == 'Kidney'
+
+
+def test_cell_types_list_cached(client, mock_upstream):
+    mock_post = mock_upstream(cells_json)
+    response = client.get('/cell-types/list.json')
+    assert response.status == '200 OK'
+    assert response.json == ['Kidney']
+    assert all(call.args[0].startswith('should-be-overridden/api/')
+               for call in mock_post.call_args_list)
+    calls = mock_post.call_count
+
+    assert client.get('/cell-types/list.json').json == ['Kidney']
+    assert mock_post.call_count == calls
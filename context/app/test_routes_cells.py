@@ -0,0 +1,125 @@
+import pytest
+
+from .main import create_app
+
+
+@pytest.fixture
+def client():
+    app = create_app(testing=True)
+    with app.test_client() as client:
+        yield client
+
+
+def cells_json(path, data=None, **kwargs):
+    if path.endswith('/count/'):
+        return {'results': [{'count': 1}]}
+    if path.endswith('evaluation/'):
+        return {'results': [
+            {'uuid': 'fake-uuid', 'cell_type': 'CL:1', 'values': {'VIM': 0.5}}]}
+    return {'results': [{'query_handle': 'fake-handle'}]}
+
+
+def test_cell_percentages_cached(client, mock_upstream):
+    mock_post = mock_upstream(cells_json)
+    path = '/cells/cell-percentages-for-datasets.json'
+
+    response = client.post(f'{path}?uuid=a&uuid=b&gene_name=VIM&min_gene_expression=1')
+    assert response.status == '200 OK'
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.json == {
+        'results': [{'uuid': 'fake-uuid', 'cell_type': 'CL:1', 'values': {'VIM': 0.5}}]}
+    call_count = mock_post.call_count
+
+    # Same query, normalized:
+    response = client.post(f'{path}?uuid=b&uuid=a&gene_name=VIM&min_gene_expression=1.0')
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.json == {
+        'results': [{'uuid': 'fake-uuid', 'cell_type': 'CL:1', 'values': {'VIM': 0.5}}]}
+    assert mock_post.call_count == call_count
+
+    response = client.post(f'{path}?uuid=a&gene_name=VIM&min_gene_expression=1')
+    assert response.headers['X-Cache'] == 'MISS'
+
+    stats = client.get('/health.json').json['caches']['cells_results']
+    assert stats['memory']['hits'] == 1
+    assert stats['memory']['misses'] == 2
+
+
+@pytest.mark.parametrize(
+    'encoding,body',
+    [
+        ('json', '{"results": [{"uuid": "fake-uuid", "cell_type": "T cell", '
+                 '"values": {"VIM": 0.5}}]}'),
+        ('ndjson', '{"uuid": "fake-uuid", "cell_type": "T cell", "values": {"VIM": 0.5}}\n'),
+        ('columns', '{"uuid": ["fake-uuid"], "cell_type": ["T cell"], "values": {"VIM": [0.5]}}\n')
+    ])
+def test_cell_expression_streamed(client, mocker, mock_upstream, encoding, body):
+    mock_upstream(cells_json)
+    mocker.patch(
+        'app.routes_cells.translate_clids', side_effect=lambda clids: ['T cell'] * len(clids))
+    path = ('/cells/cell-expression-in-dataset.json'
+            f'?uuid=a&cell_variable_names=VIM&format={encoding}')
+
+    response = client.post(path)
+    assert response.status == '200 OK'
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_data(as_text=True) == body
+
+    response = client.post(path)
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.get_data(as_text=True) == body
+
+
+def make_cells_json_failing_page(failing_call):
+    evaluations = []
+
+    def failing_cells_json(path, data=None, **kwargs):
+        if path.endswith('/count/'):
+            return {'results': [{'count': 2}]}
+        if path.endswith('evaluation/'):
+            evaluations.append(path)
+            if len(evaluations) == failing_call:
+                raise Exception('Cells API down')
+            return {'results': [
+                {'uuid': 'fake-uuid', 'cell_type': 'CL:1', 'values': {'VIM': 0.5}}]}
+        return {'results': [{'query_handle': 'fake-handle'}]}
+    return failing_cells_json
+
+
+@pytest.mark.parametrize(
+    'encoding,last_line',
+    [
+        ('json', '"values": {"VIM": 0.5}}], '
+                 '"error": "Cells API request failed after streaming started: Cells API down"}'),
+        ('ndjson', '{"error": '
+                   '"Cells API request failed after streaming started: Cells API down"}'),
+    ])
+def test_cell_expression_later_page_fails(client, mocker, mock_upstream, encoding, last_line):
+    client.application.config['CELLS_EXPRESSION_PAGE_SIZE'] = 1
+    mock_upstream(make_cells_json_failing_page(2))
+    mocker.patch(
+        'app.routes_cells.translate_clids', side_effect=lambda clids: ['T cell'] * len(clids))
+    path = ('/cells/cell-expression-in-dataset.json'
+            f'?uuid=a&cell_variable_names=VIM&format={encoding}')
+
+    response = client.post(path)
+    assert response.status == '200 OK'
+    assert response.get_data(as_text=True).strip().endswith(last_line)
+
+    # Incomplete results are not cached.
+    mock_upstream(make_cells_json_failing_page(None))
+    response = client.post(path)
+    assert response.headers['X-Cache'] == 'MISS'
+    assert 'error' not in response.get_data(as_text=True)
+
+
+def test_cell_expression_first_page_fails(client, mock_upstream):
+    mock_upstream(make_cells_json_failing_page(1))
+    # Fetched before the response starts, so the error is reported normally.
+    with pytest.raises(Exception, match='Cells API down'):
+        client.post('/cells/cell-expression-in-dataset.json?uuid=a&cell_variable_names=VIM')
+
+
+def test_cell_expression_bad_format(client):
+    response = client.post('/cells/cell-expression-in-dataset.json?uuid=a&format=xml')
+    assert response.status == '400 BAD REQUEST'
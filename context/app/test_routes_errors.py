@@ -29,7 +29,7 @@ def mock_post_400(path, **kwargs):
 
 
 def test_400_html_page(client, mocker):
-    mocker.patch('requests.post', side_effect=mock_post_400)
+    mocker.patch('requests.Session.post', side_effect=mock_post_400)
     response = client.get('/browse/donor/FAKE')
     assert response.status == '400 BAD REQUEST'
 
@@ -46,7 +46,7 @@ def mock_post_401(path, **kwargs):
 
 
 def test_401_html_page(client, mocker):
-    mocker.patch('requests.post', side_effect=mock_post_401)
+    mocker.patch('requests.Session.post', side_effect=mock_post_401)
     response = client.get('/browse/donor/FAKE')
     assert response.status == '401 UNAUTHORIZED'
 
@@ -73,6 +73,6 @@ def mock_timeout_post(path, **kwargs):
 
 
 def test_504_html_page(client, mocker):
-    mocker.patch('requests.post', side_effect=mock_timeout_post)
+    mocker.patch('requests.Session.post', side_effect=mock_timeout_post)
     response = client.get('/browse/donor/FAKE')
     assert response.status == '504 GATEWAY TIMEOUT'
@@ -1,3 +1,4 @@
+import gzip
 import re
 import xml.etree.ElementTree as ET
 from xml.etree.ElementTree import ParseError
@@ -5,9 +6,13 @@ import json
 
 
 import pytest
+import requests
+from werkzeug.exceptions import Forbidden
 
 from .main import create_app
-from .routes_browse import entity_types
+from .vitessce_confs import VitessceConfStore
+from .routes_browse import (
+    entity_types, get_sitemap, preload_raw_dataset_redirects, preload_hubmap_id_index)
 
 
 @pytest.fixture
@@ -101,8 +106,8 @@ def mock_search_donor_post(path, **kwargs):
      '/preview/multimodal-molecular-imaging-data']
 )
 def test_200_html_page(client, path, mocker):
-    mocker.patch('requests.get', side_effect=mock_prov_get)
-    mocker.patch('requests.post', side_effect=mock_search_donor_post)
+    mocker.patch('requests.Session.get', side_effect=mock_prov_get)
+    mocker.patch('requests.Session.post', side_effect=mock_search_donor_post)
     response = client.get(path)
     assert response.status == '200 OK'
     assert_is_valid_html(response)
@@ -113,7 +118,7 @@ def test_200_html_page(client, path, mocker):
     ['/browse/sample/fake-uuid', '/browse/dataset/fake-uuid', '/docs']
 )
 def test_302_redirect(client, path, mocker):
-    mocker.patch('requests.post', side_effect=mock_search_donor_post)
+    mocker.patch('requests.Session.post', side_effect=mock_search_donor_post)
     response = client.get(path)
     assert response.status == '302 FOUND'
 
@@ -123,7 +128,7 @@ def test_302_redirect(client, path, mocker):
     ['/browse/no-such-type/fake-uuid']
 )
 def test_404_details_page(client, path, mocker):
-    mocker.patch('requests.post', side_effect=mock_search_donor_post)
+    mocker.patch('requests.Session.post', side_effect=mock_search_donor_post)
     response = client.get(path)
     assert response.status == '404 NOT FOUND'
 
@@ -133,7 +138,7 @@ def test_404_details_page(client, path, mocker):
     [f'/browse/{t}/fake-uuid.json' for t in entity_types]
 )
 def test_200_json_page(client, path, mocker):
-    mocker.patch('requests.post', side_effect=mock_search_donor_post)
+    mocker.patch('requests.Session.post', side_effect=mock_search_donor_post)
     response = client.get(path)
     assert response.status == '200 OK'
     assert isinstance(json.loads(response.data.decode('utf8')), dict)
@@ -147,6 +152,232 @@ def test_login(client):
     )
 
 
+def make_mock_login_get(failing_path):
+    def mock_login_get(path, **kwargs):
+        class MockResponse():
+            def json(self):
+                return [] if path.endswith('/my_groups') else {'email': 'user@example.com'}
+
+            def raise_for_status(self):
+                pass
+        if path.endswith(failing_path):
+            raise requests.exceptions.ConnectionError('API down')
+        return MockResponse()
+    return mock_login_get
+
+
+def mock_login_post(path, **kwargs):
+    class MockResponse():
+        def json(self):
+            return {'token': 'workspaces-token'}
+    return MockResponse()
+
+
+def mock_login(client, mocker, failing_path):
+    app_client = mocker.patch('app.routes_auth.load_app_client').return_value
+    app_client.oauth2_exchange_code_for_tokens.return_value.by_resource_server = {
+        'groups.api.globus.org': {'access_token': 'groups-token'},
+        'auth.globus.org': {'access_token': 'auth-token'},
+    }
+    mocker.patch('requests.Session.get', side_effect=make_mock_login_get(failing_path))
+    mocker.patch('requests.Session.post', side_effect=mock_login_post)
+    mocker.patch('app.routes_auth.get_hubmap_globus_groups', return_value=[])
+    client.set_cookie('urlBeforeLogin', '/search')
+
+
+def test_login_return_partial_failure(client, mocker):
+    mock_login(client, mocker, failing_path='/userinfo')
+
+    response = client.get('/login?code=fake-code')
+    assert response.status == '302 FOUND'
+    assert response.location == '/search'
+    with client.session_transaction() as session:
+        assert session['is_authenticated']
+        # Email could not be fetched:
+        assert session['user_email'] == ''
+        assert session['workspaces_token'] == 'workspaces-token'
+        assert session['user_groups'] == []
+
+
+def test_login_return_groups_failure(client, mocker):
+    mock_login(client, mocker, failing_path='/my_groups')
+
+    # Logging in without groups would drop the user's permissions.
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get('/login?code=fake-code')
+    with client.session_transaction() as session:
+        assert 'is_authenticated' not in session
+
+
+def test_sitemap(client, mock_es_hits):
+    client.application.config['SITEMAP_CHUNK_SIZE'] = 2
+    mock_post = mock_es_hits([{'uuid': f'uuid-{i}'} for i in range(3)])
+
+    index = client.get('/sitemap.xml', headers={'Accept-Encoding': 'gzip'})
+    assert index.status == '200 OK'
+    assert index.headers['Content-Encoding'] == 'gzip'
+    assert index.last_modified is not None
+    assert 'http://localhost/sitemaps/1.txt' in gzip.decompress(index.data).decode('utf8')
+    assert mock_post.call_count == 1
+
+    chunk = client.get('/sitemaps/1.txt', headers={'Accept-Encoding': 'identity'})
+    assert chunk.data.decode('utf8') == 'http://localhost/browse/dataset/uuid-2'
+    assert client.get('/sitemaps/2.txt').status == '404 NOT FOUND'
+    assert client.get('/sitemap.txt').data.decode('utf8').count('/browse/dataset/') == 3
+
+    not_modified = client.get(
+        '/sitemap.xml', headers={'If-Modified-Since': index.headers['Last-Modified']})
+    assert not_modified.status == '304 NOT MODIFIED'
+    # Generated once:
+    assert mock_post.call_count == 1
+
+
+def test_raw_dataset_redirect_from_index(client, mock_es_hits):
+    mock_post = mock_es_hits([
+        {'uuid': 'processed-uuid', 'hubmap_id': 'HBM123', 'entity_type': 'Dataset',
+         'processing': 'processed', 'pipeline': 'Salmon', 'status': 'Published',
+         'ancestor_ids': ['raw-uuid']},
+        {'uuid': 'raw-uuid', 'hubmap_id': 'HBM456', 'entity_type': 'Dataset',
+         'processing': 'raw', 'status': 'Published', 'ancestor_ids': []},
+    ])
+    app = client.application
+    with app.app_context():
+        preload_raw_dataset_redirects(app)
+    scan_calls = mock_post.call_count
+
+    response = client.get('/browse/dataset/processed-uuid?marker=VIM')
+    assert response.status == '302 FOUND'
+    assert response.location == (
+        '/browse/dataset/raw-uuid?redirected=True&redirectedFromId=HBM123'
+        '&redirectedFromPipeline=Salmon&marker=VIM#section-salmon-published')
+    assert mock_post.call_count == scan_calls
+
+
+def test_hbm_redirect_projected_lookup(client, mock_es_hits):
+    mock_post = mock_es_hits([{'uuid': 'fake-uuid', 'entity_type': 'Dataset'}])
+    response = client.get('/browse/hbm123.abcd.456')
+    assert response.status == '302 FOUND'
+    assert response.location == '/browse/dataset/fake-uuid'
+    assert mock_post.call_args.kwargs['json']['_source'] == ['uuid', 'entity_type']
+
+
+def test_hbm_and_latest_redirects_from_index(client, mock_es_hits):
+    mock_post = mock_es_hits([
+        {'uuid': 'uuid-v1', 'hubmap_id': 'HBM123.ABCD.456', 'entity_type': 'Dataset',
+         'next_revision_uuid': 'uuid-v2'},
+        {'uuid': 'uuid-v2', 'hubmap_id': 'HBM789.ABCD.012', 'entity_type': 'Dataset'},
+    ])
+    app = client.application
+    with app.app_context():
+        preload_hubmap_id_index(app)
+    scan_calls = mock_post.call_count
+
+    response = client.get('/browse/HBM123.ABCD.456')
+    assert response.location == '/browse/dataset/uuid-v1'
+    with client.session_transaction() as session:
+        # Only public revisions are indexed.
+        del session['groups_token']
+    response = client.get('/browse/latest/dataset/uuid-v1')
+    assert response.location == '/browse/dataset/uuid-v2'
+    assert mock_post.call_count == scan_calls
+
+
+def test_scans_shared_across_workers(tmp_path, mock_es_hits):
+    mock_post = mock_es_hits([
+        {'uuid': 'uuid-v1', 'hubmap_id': 'HBM123.ABCD.456', 'entity_type': 'Dataset'}])
+    # Each app stands in for a worker, with the same instance folder.
+    apps = [create_app(testing=True) for _ in range(2)]
+    for app in apps:
+        app.config['SCAN_SNAPSHOT_DIR'] = str(tmp_path)
+        with app.app_context():
+            preload_hubmap_id_index(app)
+            get_sitemap(app)
+        if app is apps[0]:
+            scan_calls = mock_post.call_count
+
+    assert mock_post.call_count == scan_calls
+    with apps[1].app_context():
+        assert apps[1].extensions['hubmap_id_index'].get('HBM123.ABCD.456') == (
+            'uuid-v1', 'Dataset')
+        assert get_sitemap(apps[1]).uuids == ('uuid-v1',)
+
+
+def test_vitessce_conf_cache(client, mocker, mock_es_hits):
+    mock_es_hits([
+        {'uuid': 'fake-uuid', 'entity_type': 'Dataset', 'last_modified_timestamp': 1,
+         'vitessce-hints': []}])
+    get_conf = mocker.patch(
+        'app.portal_client.PortalApiClient.get_vitessce_conf_cells_and_lifted_uuid')
+    get_conf.return_value.vitessce_conf.conf = {'layers': []}
+
+    response = client.get('/browse/dataset/fake-uuid.vitessce.json')
+    assert response.json == {'layers': []}
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.cache_control.private
+    etag = response.headers['ETag']
+
+    response = client.get(
+        '/browse/dataset/fake-uuid.vitessce.json', headers={'If-None-Match': etag})
+    assert response.status == '304 NOT MODIFIED'
+    assert response.headers['X-Cache'] == 'HIT'
+    assert get_conf.call_count == 1
+
+    client.get('/browse/dataset/fake-uuid.vitessce.json?marker=VIM')
+    assert get_conf.call_count == 2
+
+
+def test_vitessce_conf_error_not_cached(client, mocker, mock_es_hits):
+    mock_es_hits([
+        {'uuid': 'fake-uuid', 'entity_type': 'Dataset', 'last_modified_timestamp': 1,
+         'vitessce-hints': []}])
+    get_conf = mocker.patch(
+        'app.portal_client.PortalApiClient.get_vitessce_conf_cells_and_lifted_uuid',
+        side_effect=Exception('assets 503'))
+
+    for _ in range(2):
+        response = client.get('/browse/dataset/fake-uuid.vitessce.json')
+        assert response.status == '200 OK'
+        assert 'assets 503' in json.dumps(response.json)
+        assert response.cache_control.no_store
+        assert 'ETag' not in response.headers
+    assert get_conf.call_count == 2
+    assert get_conf.call_args.kwargs['wrap_error'] is False
+
+
+def test_vitessce_conf_http_error_wrapped(client, mocker, mock_es_hits):
+    mock_es_hits([
+        {'uuid': 'fake-uuid', 'entity_type': 'Dataset', 'last_modified_timestamp': 1,
+         'vitessce-hints': []}])
+    mocker.patch(
+        'app.portal_client.PortalApiClient.get_vitessce_conf_cells_and_lifted_uuid',
+        side_effect=Forbidden())
+
+    response = client.get('/browse/dataset/fake-uuid.vitessce.json')
+    assert response.status == '200 OK'
+    assert response.json['name'] == 'Error'
+    assert response.cache_control.no_store
+
+
+def test_vitessce_conf_from_store(client, mocker, tmp_path, mock_es_hits):
+    mock_es_hits([
+        {'uuid': 'fake-uuid', 'entity_type': 'Dataset', 'last_modified_timestamp': 1,
+         'vitessce-hints': []}])
+    get_conf = mocker.patch(
+        'app.portal_client.PortalApiClient.get_vitessce_conf_cells_and_lifted_uuid')
+    client.application.config['VITESSCE_CONF_STORE_DIR'] = tmp_path
+    VitessceConfStore(tmp_path).put('fake-uuid', 1, {'conf': {'stored': True}, 'etag': 'abc'})
+    with client.session_transaction() as session:
+        del session['groups_token']
+
+    response = client.get('/browse/dataset/fake-uuid.vitessce.json')
+    assert response.json == {'stored': True}
+    assert response.headers['X-Cache'] == 'STORE'
+    assert response.headers['ETag'] == '"abc"'
+    assert response.cache_control.public
+    assert 'Cookie' in response.vary
+    assert get_conf.call_count == 0
+
+
 def test_robots_txt_disallow(client):
     response = client.get('/robots.txt')
     assert 'Disallow: /' in response.data.decode('utf8')
@@ -181,3 +412,25 @@ def test_truncate_and_redirect(client, path_status):
     assert response.status == status
     if response.status == '302 FOUND':
         assert [response.location] == location
+
+
+def test_entity_fetched_once_across_views(client, mocker):
+    mock_post = mocker.patch('requests.Session.post', side_effect=mock_search_donor_post)
+    assert client.get('/browse/donor/fake-uuid.json').status == '200 OK'
+    assert client.get('/browse/donor/fake-uuid.rui.json').status == '404 NOT FOUND'
+    assert mock_post.call_count == 1
+
+
+def test_markdown_etag(client):
+    response = client.get('/apis')
+    assert response.status == '200 OK'
+    etag = response.headers['ETag']
+    assert client.get('/apis', headers={'If-None-Match': etag}).status == '304 NOT MODIFIED'
+    assert client.get('/apis', headers={'If-None-Match': '"stale"'}).status == '200 OK'
+
+
+def test_health_without_warmup(client):
+    # Warm-up is disabled under testing.
+    response = client.get('/health.json')
+    assert response.status == '200 OK'
+    assert response.json == {'ready': True, 'tasks': {}, 'caches': {}, 'executor': None}
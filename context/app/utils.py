@@ -1,21 +1,34 @@
 from urllib.parse import urlparse
 from flask import (current_app, request, session, Blueprint)
 
-from portal_visualization.client import ApiClient
 from portal_visualization.mock_client import MockApiClient
-from os.path import dirname
-from pathlib import Path
 
-from yaml import safe_load
+from .caching import get_cache, get_refreshing_value
+from .http_pool import get_session, UpstreamJSON
+from .portal_client import PortalApiClient
 
 entity_types = ['donor', 'sample', 'dataset', 'support', 'collection', 'publication']
 
 
 def get_client():
+    return _make_client(session['groups_token'])
+
+
+def get_public_client():
+    '''
+    For work done outside of a request, like background refreshes:
+    Only public documents are visible. Requires an app context.
+    '''
+    return _make_client('')
+
+
+def _make_client(groups_token):
     if current_app.config.get('IS_MOCK'):
         return MockApiClient()
-    return ApiClient(
-        groups_token=session['groups_token'],
+    return PortalApiClient(
+        entity_cache=get_cache('entity'),
+        session=get_session(current_app),
+        groups_token=groups_token,
         elasticsearch_endpoint=current_app.config['ELASTICSEARCH_ENDPOINT'],
         portal_index_path=current_app.config['PORTAL_INDEX_PATH'],
         ubkg_endpoint=current_app.config['UBKG_ENDPOINT'],
@@ -26,6 +39,16 @@ def get_client():
     )
 
 
+def get_upstream_json(name, url):
+    '''
+    For JSON the portal pulls from static upstream URLs:
+    Refreshed in the background after `<NAME>_TTL` seconds,
+    revalidated with ETags, and served stale if the upstream fails.
+    '''
+    app = current_app._get_current_object()
+    return get_refreshing_value(name, UpstreamJSON(url, app)).get()
+
+
 def get_default_flask_data():
     return {
         'endpoints': {
@@ -61,22 +84,12 @@ def get_url_base_from_request():
     return f'{scheme}://{netloc}'
 
 
+def get_organ_registry():
+    return current_app.extensions['organ_registry']
+
+
 def get_organs():
-    dir_path = Path(dirname(__file__) + '/organ')
-    organs = {p.stem: safe_load(p.read_text()) for p in dir_path.glob('*.yaml')}
-    return organs
-
-
-def get_organ_name_mapping():
-    organs = get_organs()
-    organ_file_names = {k: k for k, _ in organs.items()}
-    # Add search field for each organ as additional keys
-    for k, v in organs.items():
-        search = v['search']
-        if len(search) > 0:
-            for s in search:
-                organ_file_names[s.lower()] = k
-    return organ_file_names
+    return get_organ_registry().organs
 
 
 # Redirect to primary dataset if this entity is
@@ -0,0 +1,144 @@
+import gzip
+import json
+from hashlib import sha256
+from importlib.metadata import PackageNotFoundError, version
+from os import getpid, makedirs, replace
+from pathlib import Path
+from threading import get_ident
+
+
+def _get_builder_version():
+    # Confs built by another version of portal-visualization may differ.
+    try:
+        return version('portal-visualization')
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+# Bump if the file layout changes: Old confs are then ignored.
+_FORMAT = 'vitessce-conf-1'
+
+
+def build_vitessce_conf(client, entity, parent=None, marker=None, wrap_error=True):
+    '''
+    Returns the Vitessce conf for the entity, and an ETag which is a hash of the conf,
+    so that every worker, and the precompute script, send the same ETag for the same conf.
+    `parent` is the parent entity, if one was requested.
+
+    >>> from unittest.mock import Mock
+    >>> client = Mock()
+    >>> client.get_vitessce_conf_cells_and_lifted_uuid.return_value.vitessce_conf.conf = None
+    >>> built = build_vitessce_conf(client, {'uuid': 'fake', 'vitessce-hints': []})
+    >>> built['conf'] is None, len(built['etag'])
+    (True, 64)
+    '''
+    epic_uuid = None
+    if 'segmentation_mask' in entity.get('vitessce-hints') and entity.get(
+            'status') != 'Error':
+        if parent is None:
+            ancestors = entity.get('immediate_ancestor_ids')
+            if len(ancestors) > 0:
+                parent = ancestors[0]
+        if 'epic' in entity.get('vitessce-hints'):
+            epic_uuid = entity['uuid']
+
+    conf = client.get_vitessce_conf_cells_and_lifted_uuid(
+        entity,
+        marker=marker,
+        parent=parent,
+        epic_uuid=epic_uuid,
+        wrap_error=wrap_error,
+    ).vitessce_conf.conf
+    etag = sha256(json.dumps(conf, sort_keys=True).encode()).hexdigest()
+    return {'conf': conf, 'etag': etag}
+
+
+def build_error_conf(error):
+    '''
+    A conf which Vitessce shows as a description of the error,
+    like the ones portal-visualization returns when errors are wrapped.
+
+    >>> build_error_conf(Exception('assets 503'))['layout'][0]['props']['description']
+    'Error while generating the Vitessce configuration: assets 503'
+    '''
+    return {
+        'name': 'Error',
+        'version': '1.0.4',
+        'datasets': [],
+        'initStrategy': 'none',
+        'layout': [{
+            'component': 'description',
+            'props': {
+                'description': f'Error while generating the Vitessce configuration: {error}'},
+            'x': 0, 'y': 0, 'w': 12, 'h': 1,
+        }],
+    }
+
+
+class VitessceConfStore(object):
+    '''
+    Confs for public datasets, built ahead of time by etc/qa/find-vis-bugs.py,
+    and read by the portal before it builds one itself.
+    Each is saved under the dataset's uuid and last modified time,
+    so a conf is only found while it is current, and the script only rebuilds
+    datasets that have changed.
+
+    >>> from tempfile import mkdtemp
+    >>> store = VitessceConfStore(mkdtemp())
+    >>> store.put('fake-uuid', 1, {'conf': None, 'etag': 'abc'})
+    >>> store.get('fake-uuid', 1)
+    {'conf': None, 'etag': 'abc'}
+    >>> store.put('fake-uuid', 2, {'conf': {}, 'etag': 'def'})
+    >>> store.get('fake-uuid', 1) is None  # Replaced
+    True
+    >>> store.prune(keep_uuids=[])
+    1
+    >>> store.get('fake-uuid', 2) is None
+    True
+    '''
+
+    def __init__(self, dir_path):
+        self.dir_path = Path(dir_path)
+        self.version = f'{_FORMAT}-{_get_builder_version()}'
+
+    def _path(self, uuid, last_modified_timestamp):
+        return self.dir_path / f'{uuid}.{last_modified_timestamp}.{self.version}.json.gz'
+
+    def _iter_paths(self, uuid='*'):
+        return self.dir_path.glob(f'{uuid}.*.json.gz')
+
+    def has(self, uuid, last_modified_timestamp):
+        return self._path(uuid, last_modified_timestamp).exists()
+
+    def get(self, uuid, last_modified_timestamp):
+        try:
+            with gzip.open(self._path(uuid, last_modified_timestamp), 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # Not built yet, or a partial file.
+            return None
+
+    def put(self, uuid, last_modified_timestamp, built):
+        makedirs(self.dir_path, exist_ok=True)
+        path = self._path(uuid, last_modified_timestamp)
+        tmp_path = path.with_suffix(f'.{getpid()}-{get_ident()}.tmp')
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(built, f)
+        # Atomic, so the portal never reads a partial file.
+        replace(tmp_path, path)
+        for old_path in self._iter_paths(uuid):
+            if old_path != path:
+                old_path.unlink(missing_ok=True)
+
+    def prune(self, keep_uuids):
+        '''
+        Removes the confs of datasets which are no longer public,
+        and returns how many were removed.
+        '''
+        keep_uuids = set(keep_uuids)
+        removed = 0
+        for path in self._iter_paths():
+            if path.name.split('.')[0] not in keep_uuids:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
@@ -0,0 +1,94 @@
+from logging import getLogger
+from os import getpid
+from threading import Lock, Thread
+from time import time
+
+
+_logger = getLogger(__name__)
+
+
+class Warmup(object):
+    '''
+    Runs slow loaders once per worker process, on a background thread,
+    so that no request has to wait for them. Each task is called with the app,
+    inside an app context, and its status is kept for the health endpoint.
+
+    >>> from flask import Flask
+    >>> def fails(app):
+    ...     raise Exception('Upstream down')
+    >>> warmup = Warmup(Flask(__name__), {'ok': lambda app: None, 'fails': fails})
+    >>> warmup.status()['ready']
+    False
+    >>> warmup.start(background=False)
+    >>> status = warmup.status()
+    >>> status['ready']
+    False
+    >>> status['tasks']['ok']['state'], status['tasks']['fails']['state']
+    ('ready', 'failed')
+    '''
+
+    def __init__(self, app, tasks):
+        self.app = app
+        self.tasks = tasks
+        self._lock = Lock()
+        self._pid = None
+        self._states = {}
+
+    def start(self, background=True):
+        '''
+        Starts the warm-up, unless it has already been started in this process.
+        uWSGI forks workers after the app is created, and threads do not survive a fork,
+        so each worker runs its own.
+        '''
+        pid = getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._states = {name: {'state': 'pending'} for name in self.tasks}
+        if background:
+            Thread(target=self._run, daemon=True).start()
+        else:
+            self._run()
+
+    def _run(self):
+        with self.app.app_context():
+            for name, task in self.tasks.items():
+                self._states[name] = {'state': 'running'}
+                start = time()
+                try:
+                    task(self.app)
+                    state = 'ready'
+                except Exception:
+                    _logger.exception(f'Warm-up task "{name}" failed; It will load on demand.')
+                    state = 'failed'
+                self._states[name] = {'state': state, 'seconds': round(time() - start, 3)}
+
+    def status(self):
+        tasks = dict(self._states) if self._pid == getpid() else {}
+        return {
+            'ready': bool(tasks) and all(t['state'] == 'ready' for t in tasks.values()),
+            'tasks': tasks,
+        }
+
+
+def init_warmup(app, tasks):
+    '''
+    Registers the warm-up to start after uWSGI forks each worker,
+    or, without uWSGI, on the first request: The request does not wait for it.
+    '''
+    warmup = Warmup(app, tasks)
+    app.extensions['warmup'] = warmup
+    try:
+        from uwsgidecorators import postfork
+        postfork(warmup.start)
+    except ImportError:
+        pass
+
+    @app.before_request
+    def start_warmup():
+        warmup.start()
+
+    return warmup
@@ -3,8 +3,12 @@
 from pathlib import Path
 import sys
 import argparse
+import csv
+import json
+from concurrent.futures import as_completed
 from time import perf_counter
 
+import requests
 from flask import Flask
 
 # Run from anywhere:
@@ -12,13 +16,16 @@ for path in Path(__file__).parents:
     if (path / '.git').is_dir():
         sys.path.append(str(path))
         break
-from portal_visualization.client import ApiClient  # noqa: E402
 from context.app.default_config import DefaultConfig  # noqa: E402
+from context.app.executor import UpstreamExecutor  # noqa: E402
+from context.app.portal_client import PortalApiClient  # noqa: E402
+from context.app.vitessce_confs import build_vitessce_conf, VitessceConfStore  # noqa: E402
 
 
 def get_parser():
     parser = argparse.ArgumentParser(
-        description='Scan all datasets for visualization bugs. Exits with status 0 if no errors.',
+        description='Scan all datasets for visualization bugs. Exits with status 0 if no errors. '
+        'With --store, also save the confs for the portal to serve.',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument(
         '--search_url',
@@ -30,8 +37,12 @@ def get_parser():
         help='Under the Search API endpoint, the particular index to use')
     parser.add_argument(
         '--types_url',
-        default='https://ingest.api.hubmapconsortium.org/assaytype',
+        default='https://ingest.api.hubmapconsortium.org',
         help='Soft Assay endpoint')
+    parser.add_argument(
+        '--entity_url',
+        default='https://entity.api.hubmapconsortium.org',
+        help='Entity API endpoint')
     parser.add_argument(
         '--assets_url',
         default='https://assets.hubmapconsortium.org',
@@ -40,56 +51,202 @@ def get_parser():
         '--uuids',
         nargs='*',
         help='Instead of querying all public datasets, use given UUIDs')
+    parser.add_argument(
+        '--store',
+        type=Path,
+        help='Save confs in this directory, for the portal to read as VITESSCE_CONF_STORE_DIR. '
+        'Only datasets modified since their conf was saved are rebuilt, '
+        'and confs for datasets which are no longer public are removed.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Datasets to check at once: The time is almost all spent waiting for the APIs')
+    parser.add_argument(
+        '--checkpoint',
+        type=Path,
+        help='Record each dataset here as it is checked. If the scan is interrupted, '
+        'run again with the same file to skip the datasets already checked. '
+        'Removed when the scan finishes.')
+    parser.add_argument(
+        '--report',
+        type=Path,
+        help='Write the time spent on each dataset here, as .json or .csv')
     return parser
 
 
 def get_context(args):
-    search_url = args.search_url
-    types_url = args.types_url
-    assets_url = args.assets_url
-    portal_index_path = args.portal_index_path
-
-    app = Flask(__name__)
-    app.config.from_mapping({
-        'TYPE_SERVICE_ENDPOINT': types_url,
-        'ASSETS_ENDPOINT': assets_url,
-        'ELASTICSEARCH_ENDPOINT': search_url,
-        'PORTAL_INDEX_PATH': portal_index_path
-    })
-
-    return app.app_context()
-
-
-def get_errors(override_uuids):
-    errors = {}
-    client = ApiClient()
-    uuids = override_uuids or client.get_all_dataset_uuids()
-    waiting_for_json = 0
-    waiting_for_conf = 0
-    for (i, uuid) in enumerate(uuids):
-        before_json = perf_counter()
+    # The client reports upstream errors through the app.
+    return Flask(__name__).app_context()
+
+
+def get_client(args):
+    return PortalApiClient(
+        session=requests.Session(),
+        elasticsearch_endpoint=args.search_url,
+        portal_index_path=args.portal_index_path,
+        assets_endpoint=args.assets_url,
+        soft_assay_endpoint=args.types_url,
+        soft_assay_endpoint_path=DefaultConfig.SOFT_ASSAY_ENDPOINT_PATH,
+        entity_api_endpoint=args.entity_url,
+    )
+
+
+def get_datasets(client, override_uuids):
+    '''
+    Returns (uuid, last_modified_timestamp) for each dataset to check.
+    The timestamp is not known for given UUIDs, so those are always rebuilt.
+    '''
+    if override_uuids:
+        return [(uuid, None) for uuid in override_uuids]
+    return [
+        (dataset['uuid'], dataset.get('last_modified_timestamp'))
+        for dataset in client.iter_entities(
+            page_size=10000,
+            plural_lc_entity_type='datasets',
+            non_metadata_fields=['uuid', 'last_modified_timestamp'],
+            metadata_fields=[])
+    ]
+
+
+def check_dataset(client, uuid, last_modified, store=None):
+    '''
+    Returns a row with the time spent fetching the dataset and building its conf,
+    and the error, if any; None if the saved conf is still current.
+    '''
+    if store is not None and last_modified is not None and store.has(uuid, last_modified):
+        return None
+    row = {'uuid': uuid, 'fetch_seconds': None, 'conf_seconds': None, 'vis': None, 'error': None}
+    try:
+        before_fetch = perf_counter()
         dataset = client.get_entity(uuid=uuid)
-        waiting_for_json += perf_counter() - before_json
-        warn(f'{i}/{len(uuids)} ({len(errors)} errors): Checking {uuid} ...')
+        row['fetch_seconds'] = round(perf_counter() - before_fetch, 3)
+        before_conf = perf_counter()
+        # The same conf the portal builds, so the portal can serve it instead.
+        built = build_vitessce_conf(client, dataset, wrap_error=False)
+        row['conf_seconds'] = round(perf_counter() - before_conf, 3)
+        row['vis'] = built['conf'] is not None
+        if store is not None:
+            store.put(uuid, dataset.get('last_modified_timestamp'), built)
+    except Exception as e:
+        row['error'] = str(e) or repr(e)
+    return row
+
+
+def read_checkpoint(checkpoint):
+    if checkpoint is None or not checkpoint.exists():
+        return {}
+    rows = {}
+    for line in checkpoint.read_text().splitlines():
         try:
-            before_conf = perf_counter()
-            conf_uuid = client.get_vitessce_conf_cells_and_lifted_uuid(dataset, wrap_error=False)
-            warn(
-                f'\tVis: {conf_uuid.vitessce_conf.conf is not None}; '
-                f'Lifted: {conf_uuid.vis_lifted_uuid} ')
-            waiting_for_conf += perf_counter() - before_conf
-        except Exception as e:
-            warn(f'\tERROR: {e}')
-            errors[uuid] = e
-        warn(f'\tJSON: {waiting_for_json:.2f}s; Vitessce: {waiting_for_conf:.2f}s')
-    return errors
+            row = json.loads(line)
+        except ValueError:
+            # The last line may be partial, if the scan was killed.
+            continue
+        rows[row['uuid']] = row
+    return rows
+
+
+def get_rows(client, datasets, store=None, workers=1, checkpoint=None):
+    '''
+    Checks each dataset, `workers` at a time, and returns a row for each,
+    including those read from the checkpoint.
+    '''
+    rows = read_checkpoint(checkpoint)
+    todo = [(uuid, last_modified) for (uuid, last_modified) in datasets if uuid not in rows]
+    if rows:
+        warn(f'Resuming: {len(rows)} datasets already checked')
+    executor = UpstreamExecutor(max_workers=workers)
+    futures = [
+        executor.submit(check_dataset, client, uuid, last_modified, store)
+        for (uuid, last_modified) in todo
+    ]
+    unchanged = 0
+    errors = sum(1 for row in rows.values() if row['error'])
+    checkpoint_file = open(checkpoint, 'a') if checkpoint else None
+    if checkpoint_file and checkpoint_file.tell():
+        # Start on a new line, after any partial line.
+        checkpoint_file.write('\n')
+    try:
+        for (i, future) in enumerate(as_completed(futures)):
+            row = future.result()
+            if row is None:
+                unchanged += 1
+                continue
+            rows[row['uuid']] = row
+            if checkpoint_file:
+                checkpoint_file.write(json.dumps(row) + '\n')
+                checkpoint_file.flush()
+            if row['error']:
+                errors += 1
+                result = f'ERROR: {row["error"]}'
+            else:
+                result = (
+                    f'Vis: {row["vis"]}; '
+                    f'JSON: {row["fetch_seconds"]:.2f}s; Vitessce: {row["conf_seconds"]:.2f}s')
+            warn(f'{i + 1}/{len(todo)} ({errors} errors): {row["uuid"]}: {result}')
+    finally:
+        if checkpoint_file:
+            checkpoint_file.close()
+    if store is not None:
+        warn(f'{unchanged}/{len(datasets)} unchanged since their conf was saved')
+    return list(rows.values())
+
+
+def percentile(values, p):
+    # Nearest rank: The value that p percent of values are less than or equal to.
+    values = sorted(values)
+    return values[max(0, -(-len(values) * p // 100) - 1)]
+
+
+def get_summary(rows):
+    summary = {}
+    for phase in ['fetch_seconds', 'conf_seconds']:
+        values = [row[phase] for row in rows if row[phase] is not None]
+        summary[phase] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'max': max(values),
+        } if values else {'count': 0}
+    return summary
+
+
+def write_report(path, rows, summary):
+    if path.suffix == '.csv':
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(
+                f, ['uuid', 'fetch_seconds', 'conf_seconds', 'vis', 'error'])
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        path.write_text(json.dumps({'summary': summary, 'datasets': rows}, indent=2))
 
 
 def main():
     args = get_parser().parse_args()
 
+    store = VitessceConfStore(args.store) if args.store else None
+
     with get_context(args):
-        errors = get_errors(args.uuids)
+        client = get_client(args)
+        datasets = get_datasets(client, args.uuids)
+        rows = get_rows(
+            client, datasets, store=store, workers=args.workers, checkpoint=args.checkpoint)
+    if store is not None and not args.uuids:
+        removed = store.prune(keep_uuids=[uuid for (uuid, _) in datasets])
+        warn(f'Removed {removed} confs for datasets which are no longer public')
+    if args.checkpoint:
+        # Finished: The next scan starts over.
+        args.checkpoint.unlink(missing_ok=True)
+
+    summary = get_summary(rows)
+    for phase, stats in summary.items():
+        warn(f'{phase}: ' + '; '.join(f'{k}: {v}' for k, v in stats.items()))
+    if args.report:
+        write_report(args.report, rows, summary)
+
+    errors = {row['uuid']: row['error'] for row in rows if row['error']}
 
     if not errors:
         print('No errors')